@@ -0,0 +1,16 @@
+import time
+import cv2
+
+
+def open_camera(args):
+    capture = cv2.VideoCapture()
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, args.width)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, args.height)
+    capture.set(cv2.CAP_PROP_FPS, args.fps)
+    capture.open(args.camera)
+    time.sleep(0.02)  # allow camera to initialize
+
+    if capture.isOpened() == False:
+        print("Device not opened")
+        exit(1)
+    return capture
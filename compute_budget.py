@@ -0,0 +1,119 @@
+from collections import deque
+
+# Features whose compute time is tracked, by parameter group
+COST_GROUPS = {
+    "mouth_hull": "mouth",
+    "cheek_puff": "cheek_puff",
+    "eye_left_open": "eye_open",
+    "eye_right_open": "eye_open",
+    "blendshapes": "blendshapes",
+    "blendshape_scores": "blendshapes",
+    "pose": "pose",
+}
+
+# Update interval in frames of each group at each degradation level, in the
+# order they are given up. The ellipse fits go first; mouth and head pose are
+# never shed.
+SHED_LEVELS = [
+    {},
+    {"cheek_puff": 2},
+    {"cheek_puff": 4, "eye_open": 2},
+    {"cheek_puff": 8, "eye_open": 4},
+]
+
+ADJUST_INTERVAL_FRAMES = 15
+# only step back up to full quality when the full cost is well under budget
+RECOVER_FRACTION = 0.7
+
+
+# Keeps the per-frame parameter math within budget_ms. The cost of each group
+# and of whole frames is measured over a rolling window; when frames take
+# longer than the budget the degradation level is raised, and expensive groups
+# are only recomputed every few frames, reusing their last values in between.
+# Meant to be used from the single thread that handles detector results.
+class ComputeBudget:
+    def __init__(self, budget_ms, window=30):
+        self.budget_sec = budget_ms / 1000
+        self.feature_costs = {name: deque(maxlen=window) for name in COST_GROUPS}
+        self.frame_costs = deque(maxlen=window)
+        self.level = 0
+        self.frame = 0
+        self.last_adjusted = 0
+        self.last_values = {}
+        self.last_computed = {}
+        self.level_frames = [0] * len(SHED_LEVELS)
+
+    # True if the feature should reuse its last value this frame
+    def skip(self, name):
+        group = COST_GROUPS.get(name)
+        interval = SHED_LEVELS[self.level].get(group, 1)
+        if interval == 1 or name not in self.last_values:
+            return False
+        return self.frame - self.last_computed[name] < interval
+
+    def last_value(self, name):
+        return self.last_values[name]
+
+    def record(self, name, value, cost_sec):
+        self.last_values[name] = value
+        self.last_computed[name] = self.frame
+        self.feature_costs[name].append(cost_sec)
+
+    def tracks(self, name):
+        return name in COST_GROUPS
+
+    def end_frame(self, cost_sec):
+        self.frame_costs.append(cost_sec)
+        self.level_frames[self.level] += 1
+        self.frame += 1
+        if self.frame - self.last_adjusted >= ADJUST_INTERVAL_FRAMES:
+            self.adjust()
+
+    # Mean cost of the recent frames, since the last level change at most
+    def mean_frame_cost_ms(self):
+        return self.mean(self.frame_costs) * 1000
+
+    def mean(self, costs):
+        return sum(costs) / len(costs) if len(costs) > 0 else 0.0
+
+    # Mean cost of computing every feature in the group once
+    def group_cost(self, group):
+        return sum(
+            self.mean(costs)
+            for name, costs in self.feature_costs.items()
+            if COST_GROUPS[name] == group
+        )
+
+    def adjust(self):
+        self.last_adjusted = self.frame
+        level = self.level
+        if self.mean(self.frame_costs) > self.budget_sec:
+            level = min(level + 1, len(SHED_LEVELS) - 1)
+        elif level > 0:
+            # cost of the groups being shed if they were computed every frame
+            restored = sum(
+                self.group_cost(group) * (1 - 1 / interval)
+                for group, interval in SHED_LEVELS[level].items()
+            )
+            if (
+                self.mean(self.frame_costs) + restored
+                < self.budget_sec * RECOVER_FRACTION
+            ):
+                level -= 1
+        if level != self.level:
+            print(
+                f"Compute budget degradation level {self.level} -> {level}, mean frame cost {self.mean(self.frame_costs) * 1000:.2f} ms"
+            )
+            self.level = level
+            self.frame_costs.clear()
+
+    def summary(self):
+        lines = [
+            f"Compute budget {self.budget_sec * 1000:.1f} ms, frames per degradation level:"
+        ]
+        for level, frames in enumerate(self.level_frames):
+            lines.append(f"  {level}: {frames}")
+        lines.append("Mean cost per group:")
+        for group in dict.fromkeys(COST_GROUPS.values()):
+            lines.append(f"  {group}: {self.group_cost(group) * 1000:.3f} ms")
+        return "\n".join(lines)
@@ -129,42 +129,110 @@ LIP_LANDMARK_SET = {
 }
 
 
+LANDMARK_REGIONS = {
+    "face_oval": sorted(FACE_OVAL_LANDMARK_SET),
+    "lips": sorted(LIP_LANDMARK_SET),
+    "left_eye": sorted(LEFT_EYE_LANDMARK_SET),
+    "right_eye": sorted(RIGHT_EYE_LANDMARK_SET),
+}
+
+
+# Reuses the hull areas and ellipse ratios of a region across frames while its
+# landmarks stay within epsilon (normalized image units) of where they were when
+# the metrics were last computed. Comparing against that reference rather than
+# the previous frame means slow drift still triggers a recompute.
+class LandmarkRegionCache:
+    def __init__(self, epsilon):
+        self.epsilon = epsilon
+        self.entries = {}
+        self.hits = {region: 0 for region in LANDMARK_REGIONS}
+        self.misses = {region: 0 for region in LANDMARK_REGIONS}
+
+    def get(self, region, metric, points, compute):
+        entry = self.entries.get(region)
+        if (
+            entry is None
+            or entry[0].shape != points.shape
+            or np.max(np.abs(points - entry[0])) >= self.epsilon
+        ):
+            entry = (points, {})
+            self.entries[region] = entry
+        elif metric in entry[1]:
+            self.hits[region] += 1
+            return entry[1][metric]
+        self.misses[region] += 1
+        value = compute()
+        entry[1][metric] = value
+        return value
+
+    def summary(self):
+        lines = [f"Landmark region cache (epsilon {self.epsilon}):"]
+        for region in LANDMARK_REGIONS:
+            lookups = self.hits[region] + self.misses[region]
+            if lookups == 0:
+                continue
+            lines.append(
+                f"  {region}: {self.hits[region]} hits, {self.misses[region]} misses, {100 * self.hits[region] / lookups:.1f}% hit rate"
+            )
+        return "\n".join(lines)
+
+
+# Region points and hulls are only built when a metric needs them, and at most once.
+# With a region cache, metrics of regions that have barely moved are reused.
 class LandmarkParamsComputer:
-    def __init__(self, landmarks):
-        self.face_points = []
-        self.face_points_xy = []
-        self.face_hull = None
-        self.lip_points = []
-        self.lip_hull = None
-        self.eye_left_points = []
-        self.eye_right_points = []
-        self.read_landmarks(landmarks)
-
-    def read_landmarks(self, landmarks):
-        for idx in range(len(landmarks)):
-            landmark = landmarks[idx]
-            if idx in FACE_OVAL_LANDMARK_SET:
-                self.face_points.extend([landmark.x, landmark.y, landmark.z])
-                self.face_points_xy.append((landmark.x, landmark.y))
-            if idx in LIP_LANDMARK_SET:
-                self.lip_points.extend([landmark.x, landmark.y, landmark.z])
-            if idx in LEFT_EYE_LANDMARK_SET:
-                self.eye_left_points.append((landmark.x, landmark.y))
-            if idx in RIGHT_EYE_LANDMARK_SET:
-                self.eye_right_points.append((landmark.x, landmark.y))
-
-        self.face_hull = self.get_hull(self.face_points, FACE_OVAL_LANDMARK_SET)
-        self.lip_hull = self.get_hull(self.lip_points, LIP_LANDMARK_SET)
-
-    def get_hull(self, points, landmark_set):
-        if len(points) != (len(landmark_set) * 3):
-            return None
-        point_array = np.array(points).reshape((len(landmark_set), 3))
-        return ConvexHull(points=point_array)
+    def __init__(self, landmarks, region_cache=None):
+        self.landmarks = landmarks
+        self.region_cache = region_cache
+        self.points = {}
+        self.hulls = {}
+
+    def read_landmarks(self, region):
+        if region not in self.points:
+            landmarks = self.landmarks
+            self.points[region] = np.array(
+                [
+                    (landmarks[idx].x, landmarks[idx].y, landmarks[idx].z)
+                    for idx in LANDMARK_REGIONS[region]
+                    if idx < len(landmarks)
+                ]
+            )
+        return self.points[region]
+
+    def get_hull(self, region):
+        if region not in self.hulls:
+            points = self.read_landmarks(region)
+            if len(points) != len(LANDMARK_REGIONS[region]):
+                self.hulls[region] = None
+            else:
+                self.hulls[region] = ConvexHull(points=points)
+        return self.hulls[region]
+
+    def region_metric(self, region, metric, compute):
+        if self.region_cache is None:
+            return compute()
+        return self.region_cache.get(
+            region, metric, self.read_landmarks(region), compute
+        )
+
+    def get_hull_area(self, region):
+        def compute():
+            hull = self.get_hull(region)
+            return None if hull is None else hull.area
+
+        return self.region_metric(region, "hull_area", compute)
+
+    def get_region_ellipse_ratio(self, region):
+        return self.region_metric(
+            region,
+            "ellipse_ratio",
+            lambda: self.get_ellipse_ratio(self.read_landmarks(region)[:, :2]),
+        )
 
     def get_mouth_hull(self):
-        if self.lip_hull != None and self.face_hull != None:
-            lip_share = self.lip_hull.area / self.face_hull.area
+        lip_area = self.get_hull_area("lips")
+        face_area = self.get_hull_area("face_oval")
+        if lip_area != None and face_area != None:
+            lip_share = lip_area / face_area
             lip_share_normalized = max(
                 min((MOUTH_HULL_SCALE * (lip_share - MOUTH_HULL_OFFSET)), 1), 0
             )
@@ -181,7 +249,7 @@ class LandmarkParamsComputer:
         return a / b
 
     def get_eye_left_open(self):
-        major_minor_ratio = self.get_ellipse_ratio(self.eye_left_points)
+        major_minor_ratio = self.get_region_ellipse_ratio("left_eye")
         minor_major_ratio = 1 / major_minor_ratio
 
         minor_major_ratio_normalized = max(
@@ -190,7 +258,7 @@ class LandmarkParamsComputer:
         return minor_major_ratio_normalized
 
     def get_eye_right_open(self):
-        major_minor_ratio = self.get_ellipse_ratio(self.eye_right_points)
+        major_minor_ratio = self.get_region_ellipse_ratio("right_eye")
         minor_major_ratio = 1 / major_minor_ratio
 
         minor_major_ratio_normalized = max(
@@ -199,7 +267,7 @@ class LandmarkParamsComputer:
         return minor_major_ratio_normalized
 
     def get_cheek_puff(self):
-        major_minor_ratio = self.get_ellipse_ratio(self.face_points_xy)
+        major_minor_ratio = self.get_region_ellipse_ratio("face_oval")
         # roughly 1.5 at min and 1.7 at max
         major_minor_ratio_normalized = (
             major_minor_ratio - CHEEK_PUFF_OFFSET
@@ -1,7 +1,13 @@
 import math
+import time
 from scipy.spatial.transform import Rotation
 
 from compute_landmark_params import LandmarkParamsComputer
+from param_expressions import (
+    BLENDSHAPE_NAMES,
+    LANDMARK_INPUT_NAMES,
+    POSE_INPUT_NAMES,
+)
 
 BLINK_THRESHOLD = 0.6
 BLINK_SCALE = 0.0
@@ -119,73 +125,179 @@ def create_blendshapes_dict(blendshape_list):
     return shapes
 
 
-def compute_params_from_landmarks(request, face_landmarks):
-    params_computer = LandmarkParamsComputer(face_landmarks)
-    append_request(request, "MouthOpen", params_computer.get_mouth_hull())
-    append_request(
-        request,
-        "VoiceVolumePlusMouthOpen",
-        params_computer.get_mouth_hull() - MOUTH_OPEN_VOLUME_OFFSET,
-    )
-    append_request(request, "CheekPuff", params_computer.get_cheek_puff())
-    append_request(request, "EyeOpenRight", params_computer.get_eye_left_open())
-    append_request(request, "EyeOpenLeft", params_computer.get_eye_right_open())
-
-
-def compute_params_from_blendshapes(request, blendshape_list):
-    # Note left/right switched between mediapipe and vtube studio parameters
-    blendshapes = create_blendshapes_dict(blendshape_list)
-    # MouthSmile
-    append_request(request, "MouthSmile", get_mouth_smile(blendshapes))
-    # MouthOpen
-    # append_request(request, "MouthOpen", get_mouth_open(blendshapes))
-    # Mouth Open + Volume
-    # append_request(request, "VoiceVolumePlusMouthOpen", get_mouth_open(blendshapes) - MOUTH_OPEN_VOLUME_OFFSET)
-    # Mouth Smile + Volume Freq
-    append_request(
-        request,
-        "VoiceFrequencyPlusMouthSmile",
-        get_mouth_smile(blendshapes) * MOUTH_SMILE_SCALE,
+def get_pose(isometry):
+    # Compute rotation from transform isometry matrix
+    translation_vector = isometry[:3, 3]
+    rotation_matrix = isometry[:3, :3]
+    r = Rotation.from_matrix(rotation_matrix)
+    angles = r.as_euler("zyx", degrees=True)
+    return (
+        -translation_vector[0],
+        translation_vector[1],
+        -translation_vector[2],
+        -angles[1],
+        -angles[2],
+        angles[0],
     )
-    # Brows
-    append_request(request, "Brows", get_brows(blendshapes))
-    # BrowLeftY
-    append_request(request, "BrowLeftY", get_brows_right_y(blendshapes))
-    # BrowRightY
-    append_request(request, "BrowRightY", get_brows_left_y(blendshapes))
-    # EyeOpenLeft
-    # append_request(request, "EyeOpenLeft", get_eye_open_right(blendshapes))
-    # EyeOpenRight
-    # append_request(request, "EyeOpenRight", get_eye_open_left(blendshapes))
-    # EyeLeftX
-    append_request(request, "EyeLeftX", get_eye_right_x(blendshapes))
-    # EyeLeftY
-    append_request(request, "EyeLeftY", get_eye_right_y(blendshapes))
-    # EyeRightX
-    append_request(request, "EyeRightX", get_eye_left_x(blendshapes))
-    # EyeRightY
-    append_request(request, "EyeRightY", get_eye_left_y(blendshapes))
-
-    # Custom
-    # lilac_MouthX
-    append_request(request, "lilac_MouthX", get_mouth_x(blendshapes))
-    # lilac_BrowsLeftForm
-    append_request(request, "lilac_BrowsLeftForm", get_brows_right_form(blendshapes))
-    # lilac_BrowsRightForm
-    append_request(request, "lilac_BrowsRightForm", get_brows_left_form(blendshapes))
 
 
-def compute_params_from_matrix(request, isometry):
+def get_pose_or_zeros(isometry):
+    if isometry is None:
+        return (0.0,) * len(POSE_INPUT_NAMES)
+    return get_pose(isometry)
+
+
+def first_or_none(results):
+    return results[0] if len(results) > 0 else None
+
+
+# Intermediate features of a detection, each declared with the features it is
+# computed from. Blendshapes and the transformation matrix are missing if the
+# detector was created without them.
+FEATURES = {
+    "blendshape_list": (
+        ["detection_result"],
+        lambda result: first_or_none(result.face_blendshapes) or [],
+    ),
+    "landmark_list": (["detection_result"], lambda result: result.face_landmarks[0]),
+    "matrix": (
+        ["detection_result"],
+        lambda result: first_or_none(result.facial_transformation_matrixes),
+    ),
+    "blendshapes": (["blendshape_list"], create_blendshapes_dict),
+    "blendshape_scores": (
+        ["blendshape_list"],
+        lambda blendshape_list: [shape.score for shape in blendshape_list],
+    ),
+    "landmark_params": (["landmark_list", "region_cache"], LandmarkParamsComputer),
+    "mouth_hull": (["landmark_params"], LandmarkParamsComputer.get_mouth_hull),
+    "cheek_puff": (["landmark_params"], LandmarkParamsComputer.get_cheek_puff),
+    "eye_left_open": (["landmark_params"], LandmarkParamsComputer.get_eye_left_open),
+    "eye_right_open": (["landmark_params"], LandmarkParamsComputer.get_eye_right_open),
+    "mouth_smile": (["blendshapes"], get_mouth_smile),
+    "pose": (["matrix"], get_pose_or_zeros),
+}
+
+# Parameters sent by default, each declared with the features it is computed from
+# Note left/right switched between mediapipe and vtube studio parameters
+PARAMETERS = {
+    "MouthOpen": (["mouth_hull"], lambda mouth_hull: mouth_hull),
+    # "MouthOpen": (["blendshapes"], get_mouth_open),
+    "VoiceVolumePlusMouthOpen": (
+        ["mouth_hull"],
+        lambda mouth_hull: mouth_hull - MOUTH_OPEN_VOLUME_OFFSET,
+    ),
+    "CheekPuff": (["cheek_puff"], lambda cheek_puff: cheek_puff),
+    "EyeOpenRight": (["eye_left_open"], lambda eye_open: eye_open),
+    "EyeOpenLeft": (["eye_right_open"], lambda eye_open: eye_open),
+    # "EyeOpenRight": (["blendshapes"], get_eye_open_left),
+    # "EyeOpenLeft": (["blendshapes"], get_eye_open_right),
+    "MouthSmile": (["mouth_smile"], lambda mouth_smile: mouth_smile),
+    "VoiceFrequencyPlusMouthSmile": (
+        ["mouth_smile"],
+        lambda mouth_smile: mouth_smile * MOUTH_SMILE_SCALE,
+    ),
+    "Brows": (["blendshapes"], get_brows),
+    "BrowLeftY": (["blendshapes"], get_brows_right_y),
+    "BrowRightY": (["blendshapes"], get_brows_left_y),
+    "EyeLeftX": (["blendshapes"], get_eye_right_x),
+    "EyeLeftY": (["blendshapes"], get_eye_right_y),
+    "EyeRightX": (["blendshapes"], get_eye_left_x),
+    "EyeRightY": (["blendshapes"], get_eye_left_y),
+    # Custom
+    "lilac_MouthX": (["blendshapes"], get_mouth_x),
+    "lilac_BrowsLeftForm": (["blendshapes"], get_brows_right_form),
+    "lilac_BrowsRightForm": (["blendshapes"], get_brows_left_form),
     # Face Position
-    translation_vector = isometry[:3, 3]
-    append_request(request, "FacePositionX", -translation_vector[0])
-    append_request(request, "FacePositionY", translation_vector[1])
-    append_request(request, "FacePositionZ", -translation_vector[2])
+    "FacePositionX": (["pose"], lambda pose: pose[0]),
+    "FacePositionY": (["pose"], lambda pose: pose[1]),
+    "FacePositionZ": (["pose"], lambda pose: pose[2]),
     # Face Angle
-    # Compute rotation from transform isometry matrix
-    rotation_matrix = isometry[:3, :3]
-    r = Rotation.from_matrix(rotation_matrix)
-    angles = r.as_euler("zyx", degrees=True)
-    append_request(request, "FaceAngleX", -angles[1])
-    append_request(request, "FaceAngleY", -angles[2])
-    append_request(request, "FaceAngleZ", angles[0])
+    "FaceAngleX": (["pose"], lambda pose: pose[3]),
+    "FaceAngleY": (["pose"], lambda pose: pose[4]),
+    "FaceAngleZ": (["pose"], lambda pose: pose[5]),
+}
+
+
+# Computes features of one detection lazily, each at most once per frame.
+# With a compute budget, shed features reuse their value from an earlier frame.
+# The region cache (compute_landmark_params.LandmarkRegionCache) is shared
+# across frames, or None to compute landmark metrics every time.
+class FrameFeatures:
+    def __init__(self, detection_result, compute_budget=None, region_cache=None):
+        self.values = {
+            "detection_result": detection_result,
+            "region_cache": region_cache,
+        }
+        self.compute_budget = compute_budget
+
+    def get(self, name):
+        if name not in self.values:
+            compute_budget = self.compute_budget
+            if compute_budget is None or not compute_budget.tracks(name):
+                self.values[name] = self.compute(name)
+            elif compute_budget.skip(name):
+                self.values[name] = compute_budget.last_value(name)
+            else:
+                start = time.perf_counter()
+                value = self.compute(name)
+                compute_budget.record(name, value, time.perf_counter() - start)
+                self.values[name] = value
+        return self.values[name]
+
+    def compute(self, name):
+        dependencies, compute = FEATURES[name]
+        return compute(*[self.get(dep) for dep in dependencies])
+
+
+def enabled_parameters(disabled=()):
+    for name in disabled:
+        if name not in PARAMETERS:
+            print(f"Unknown parameter '{name}' cannot be disabled")
+    return [name for name in PARAMETERS if name not in disabled]
+
+
+def required_features(features):
+    required = set()
+    pending = list(features)
+    while len(pending) > 0:
+        name = pending.pop()
+        if name in required or name not in FEATURES:
+            continue
+        required.add(name)
+        pending.extend(FEATURES[name][0])
+    return required
+
+
+def parameter_features(parameters):
+    return {feature for name in parameters for feature in PARAMETERS[name][0]}
+
+
+# Which optional detector outputs (blendshapes, transformation matrixes) the
+# given features need, so unused outputs are not computed by mediapipe at all
+def detector_outputs(features):
+    required = required_features(features)
+    return ("blendshape_list" in required, "matrix" in required)
+
+
+def compute_params_from_features(request, frame, parameters):
+    for name in parameters:
+        dependencies, compute = PARAMETERS[name]
+        append_request(
+            request, name, compute(*[frame.get(dep) for dep in dependencies])
+        )
+
+
+def compute_params_from_program(request, program, frame):
+    inputs = []
+    if "blendshape_scores" in program.features:
+        inputs.extend(frame.get("blendshape_scores"))
+    inputs.extend([0.0] * (len(BLENDSHAPE_NAMES) - len(inputs)))
+    for name in LANDMARK_INPUT_NAMES:
+        inputs.append(frame.get(name) if name in program.features else 0.0)
+    if "pose" in program.features:
+        inputs.extend(frame.get("pose"))
+    else:
+        inputs.extend([0.0] * len(POSE_INPUT_NAMES))
+    for name, value in zip(program.names, program.evaluate(inputs)):
+        append_request(request, name, float(value))
@@ -32,9 +32,12 @@ def create_parameter(websocket, name, description, min_val, max_val, default_val
     print(json.loads(response_json))
 
 
-def create_custom_parameters(auth_token="", auth_file="auth.json"):
+# Returns the auth token, or "" if VTube Studio did not authorize the plugin
+def create_custom_parameters(
+    auth_token="", auth_file="auth.json", address="ws://localhost:8001"
+):
 
-    with connect("ws://localhost:8001") as websocket:
+    with connect(address, open_timeout=5) as websocket:
         # authenticate session
         try:
             if auth_token == "":
@@ -42,7 +45,7 @@ def create_custom_parameters(auth_token="", auth_file="auth.json"):
             vtube_studio_authenticate(websocket, auth_token)
         except:
             print("Unable to authorize")
-            exit(1)
+            return ""
 
         # Now authenticated, add parameters
         create_parameter(
@@ -0,0 +1,261 @@
+from multiprocessing import resource_tracker, shared_memory
+from collections import namedtuple
+from threading import Lock
+import json
+
+import numpy as np
+
+from param_expressions import BLENDSHAPE_NAMES
+from shared_ring import SharedRing
+
+FEED_SLOTS = 2
+META_SIZE = 64 * 1024
+NUM_LANDMARKS = 478
+MAX_PARAMETERS = 128
+
+# Layout of a result vector:
+# [names version, face found, blendshapes found, parameter count,
+#  compute budget degradation level, mean frame compute cost in ms,
+#  landmarks xyz, blendshapes, parameters]
+# The compute budget entries are -1 when there is no compute budget.
+LANDMARK_OFFSET = 6
+BLENDSHAPE_OFFSET = LANDMARK_OFFSET + NUM_LANDMARKS * 3
+PARAMETER_OFFSET = BLENDSHAPE_OFFSET + len(BLENDSHAPE_NAMES)
+RESULT_SIZE = PARAMETER_OFFSET + MAX_PARAMETERS
+
+Landmark = namedtuple("Landmark", ["x", "y", "z"])
+
+
+def remove_stale(name):
+    # a previous run that crashed can leave its shared memory behind
+    try:
+        stale = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    stale.close()
+    stale.unlink()
+
+
+# Publishes the latest frame, landmarks, blendshape scores and outgoing
+# parameters to shared memory for debug_visualize.py --attach.
+# Frames and results are each throttled to rate_hz, and publishing never
+# waits on a reader.
+# A small metadata block holds JSON describing the rings and parameter names.
+# With a compute budget, its current degradation level is published too.
+class DebugFeedPublisher:
+    def __init__(self, name, rate_hz, compute_budget=None):
+        self.name = name
+        self.compute_budget = compute_budget
+        self.interval_ms = 1000 / rate_hz
+        self.lock = Lock()
+        self.last_frame_ms = -self.interval_ms
+        self.last_result_ms = -self.interval_ms
+        self.names = None
+        self.version = 0
+        self.frame_ring = None
+
+        for suffix in ("_meta", "_data"):
+            remove_stale(name + suffix)
+        self.meta = shared_memory.SharedMemory(
+            name=name + "_meta", create=True, size=META_SIZE
+        )
+        self.meta.buf[:8] = bytes(8)
+        self.result_ring = SharedRing(
+            (RESULT_SIZE,), np.float64, FEED_SLOTS, name=name + "_data", create=True
+        )
+        self.result = np.zeros(RESULT_SIZE)
+        self.write_meta()
+
+    def write_meta(self):
+        with self.lock:
+            meta = {
+                "version": self.version,
+                "names": self.names or [],
+                "result_ring": self.result_ring.attach_args(),
+                "frame_ring": (
+                    None if self.frame_ring is None else self.frame_ring.attach_args()
+                ),
+            }
+            data = json.dumps(meta).encode()
+            self.meta.buf[8 : 8 + len(data) + 1] = data + b"\0"
+            # bump the change counter last so readers see the whole document
+            counter = int.from_bytes(self.meta.buf[:8], "little") + 1
+            self.meta.buf[:8] = counter.to_bytes(8, "little")
+
+    def publish_frame(self, frame, timestamp_ms):
+        if timestamp_ms - self.last_frame_ms < self.interval_ms:
+            return
+        self.last_frame_ms = timestamp_ms
+        if self.frame_ring is None or self.frame_ring.shape != frame.shape:
+            if self.frame_ring is not None:
+                self.frame_ring.close()
+            remove_stale(self.name + "_frames")
+            self.frame_ring = SharedRing(
+                frame.shape,
+                frame.dtype,
+                FEED_SLOTS,
+                name=self.name + "_frames",
+                create=True,
+            )
+            self.write_meta()
+        self.frame_ring.write(frame, timestamp_ms)
+
+    def publish_result(self, timestamp_ms, detection_result, names, values):
+        if timestamp_ms - self.last_result_ms < self.interval_ms:
+            return
+        self.last_result_ms = timestamp_ms
+        names = names[:MAX_PARAMETERS]
+        # frames without a face have no parameters, keep the last names
+        if len(names) > 0 and names != self.names:
+            self.names = list(names)
+            self.version += 1
+            self.write_meta()
+
+        result = self.result
+        # the vector is reused, so clear anything a previous face left behind
+        result[LANDMARK_OFFSET:] = 0
+        result[0] = self.version
+        result[1] = len(detection_result.face_landmarks) > 0
+        result[2] = result[1] and len(detection_result.face_blendshapes) > 0
+        result[3] = len(names)
+        if self.compute_budget is None:
+            result[4:6] = -1
+        else:
+            result[4] = self.compute_budget.level
+            result[5] = self.compute_budget.mean_frame_cost_ms()
+        if result[1]:
+            landmarks = detection_result.face_landmarks[0][:NUM_LANDMARKS]
+            result[LANDMARK_OFFSET : LANDMARK_OFFSET + len(landmarks) * 3] = [
+                coordinate
+                for landmark in landmarks
+                for coordinate in (landmark.x, landmark.y, landmark.z)
+            ]
+            if result[2]:
+                result[BLENDSHAPE_OFFSET:PARAMETER_OFFSET] = [
+                    shape.score for shape in detection_result.face_blendshapes[0]
+                ]
+            result[PARAMETER_OFFSET : PARAMETER_OFFSET + len(names)] = values[
+                :MAX_PARAMETERS
+            ]
+        self.result_ring.write(result, timestamp_ms)
+
+    def close(self):
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+        self.result_ring.close()
+        self.meta.close()
+        self.meta.unlink()
+
+
+DebugFeedData = namedtuple(
+    "DebugFeedData",
+    [
+        "timestamp",
+        "image",
+        "landmarks",
+        "blendshape_names",
+        "blendshape_scores",
+        "parameter_names",
+        "parameter_values",
+        "compute_level",
+        "compute_cost_ms",
+    ],
+)
+
+
+# Read-only view of a running forwarder's debug feed. Data is copied out of
+# shared memory so the publisher can keep overwriting its slots.
+class DebugFeedReader:
+    def __init__(self, name):
+        self.meta = shared_memory.SharedMemory(name=name + "_meta")
+        # not created by this process, so it must not be unlinked when it exits
+        resource_tracker.unregister(self.meta._name, "shared_memory")
+        self.meta_counter = 0
+        self.version = 0
+        self.names = []
+        self.frame_ring_args = None
+        self.frame_ring = None
+        self.result_ring = None
+
+    def read_meta(self):
+        counter = int.from_bytes(self.meta.buf[:8], "little")
+        if counter == self.meta_counter:
+            return
+        data = bytes(self.meta.buf[8:]).split(b"\0", 1)[0]
+        try:
+            meta = json.loads(data)
+        except ValueError:
+            return  # caught mid-write, try again next poll
+        if counter != int.from_bytes(self.meta.buf[:8], "little"):
+            return
+        self.meta_counter = counter
+        self.version = meta["version"]
+        self.names = meta["names"]
+        if self.result_ring is None:
+            self.result_ring = SharedRing.attach(*meta["result_ring"], unregister=True)
+        frame_ring_args = meta["frame_ring"]
+        if frame_ring_args is not None and frame_ring_args != self.frame_ring_args:
+            if self.frame_ring is not None:
+                self.frame_ring.close()
+            self.frame_ring = SharedRing.attach(*frame_ring_args, unregister=True)
+            self.frame_ring_args = frame_ring_args
+
+    def read_latest(self, ring):
+        if ring is None:
+            return None
+        sequence = ring.latest_sequence()
+        entry = ring.read(sequence)
+        if entry is None:
+            return None
+        timestamp, view = entry
+        data = np.copy(view)
+        if not ring.is_valid(sequence):
+            return None
+        return timestamp, data
+
+    # Returns the latest published data, or None if nothing is available yet
+    def poll(self):
+        self.read_meta()
+        result_entry = self.read_latest(self.result_ring)
+        if result_entry is None:
+            return None
+        timestamp, result = result_entry
+        frame_entry = self.read_latest(self.frame_ring)
+        image = None if frame_entry is None else frame_entry[1]
+
+        landmarks = []
+        blendshape_names = []
+        blendshape_scores = []
+        parameter_names = []
+        parameter_values = []
+        if result[2]:
+            blendshape_names = BLENDSHAPE_NAMES
+            blendshape_scores = result[BLENDSHAPE_OFFSET:PARAMETER_OFFSET].tolist()
+        if result[1]:
+            points = result[LANDMARK_OFFSET:BLENDSHAPE_OFFSET].reshape(-1, 3)
+            landmarks = [Landmark(*point) for point in points.tolist()]
+            # names may be from a newer version than the result, or not read yet
+            if int(result[0]) == self.version:
+                count = int(result[3])
+                parameter_names = self.names[:count]
+                parameter_values = result[
+                    PARAMETER_OFFSET : PARAMETER_OFFSET + count
+                ].tolist()
+        return DebugFeedData(
+            timestamp,
+            image,
+            landmarks,
+            blendshape_names,
+            blendshape_scores,
+            parameter_names,
+            parameter_values,
+            None if result[4] < 0 else int(result[4]),
+            None if result[5] < 0 else result[5],
+        )
+
+    def close(self):
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+        if self.result_ring is not None:
+            self.result_ring.close()
+        self.meta.close()
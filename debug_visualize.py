@@ -13,6 +13,12 @@ import time
 import cv2
 import argparse
 
+from frame_clock import FrameClock
+from detector import load_model
+from debug_feed import DebugFeedReader
+
+FEED_POLL_INTERVAL_SEC = 0.02
+
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -30,6 +36,15 @@ def get_args():
     parser.add_argument("-H", "--height", help="height of camera image", default=720)
     parser.add_argument("-f", "--fps", help="frame rate of the camera", default=30)
     parser.add_argument("-g", "--use_gpu", default=False, action="store_true")
+    parser.add_argument(
+        "--attach",
+        help="show the debug feed of a running main.py --debug-feed instead of running a detector",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--feed-name", help="name of the debug feed to attach to", default="lilac_debug"
+    )
     return parser.parse_args()
 
 
@@ -43,6 +58,8 @@ class DetectionData:
         self.image = None
         self.timestamp = 0
         self.landmarks = []
+        self.parameter_names = []
+        self.parameter_values = []
         self.new_update = False
 
     def update(self, names, scores, image, timestamp, landmarks):
@@ -54,6 +71,15 @@ class DetectionData:
             self.landmarks = landmarks
             self.new_update = True
 
+    def update_parameters(self, names, values):
+        with self.lock:
+            self.parameter_names = names
+            self.parameter_values = values
+
+    def get_parameters(self):
+        with self.lock:
+            return (self.parameter_names, self.parameter_values)
+
     def get_data(self):
         with self.lock:
             self.new_update = False
@@ -93,6 +119,13 @@ def update_figure(fig, axs, detection_data: DetectionData):
     axs[0].set_ylabel("Blendshape")
     axs[0].set_xlim([0, 1])
     axs[0].barh(names, scores)
+    if len(axs) > 2:
+        (parameter_names, parameter_values) = detection_data.get_parameters()
+        axs[2].clear()
+        axs[2].invert_yaxis()
+        axs[2].set_xlabel("Value")
+        axs[2].set_ylabel("Parameter")
+        axs[2].barh(parameter_names, parameter_values)
     if image is not None:
         annotated_image = np.copy(image)
         face_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
@@ -147,7 +180,7 @@ def debug_visualize(args):
 
     # Initialize mediapipe face landmark detector
     base_options = python.BaseOptions(
-        model_asset_path="face_landmarker_v2_with_blendshapes.task",
+        model_asset_buffer=load_model(args.model),
         delegate=delegate,
     )
 
@@ -176,6 +209,7 @@ def debug_visualize(args):
     detector = vision.FaceLandmarker.create_from_options(options)
 
     attempts = 0
+    frame_clock = FrameClock()
 
     try:
         while True:
@@ -188,7 +222,7 @@ def debug_visualize(args):
             if ret:
                 attempts = 0
                 image = mp.Image(image_format=mp.ImageFormat.SRGB, data=cv2_image)
-                timestamp = int(capture.get(cv2.CAP_PROP_POS_MSEC))
+                timestamp = frame_clock.timestamp()
                 detector.detect_async(image, timestamp)
                 if detection_data.is_new_update:
                     update_figure(fig, axs, detection_data)
@@ -205,6 +239,55 @@ def debug_visualize(args):
     capture.release()
 
 
+# Shows the debug feed published by main.py --debug-feed, so no second camera
+# or detector is needed while the forwarder is running
+def debug_visualize_attached(args):
+    try:
+        reader = DebugFeedReader(args.feed_name)
+    except FileNotFoundError:
+        print("No debug feed found, start main.py with --debug-feed")
+        exit(1)
+
+    plt.ion()
+    fig, axs = plt.subplots(ncols=3)
+    detection_data = DetectionData()
+    last_timestamp = None
+
+    try:
+        while True:
+            if not plt.fignum_exists(fig.number):
+                print("Figure closed, exiting program")
+                break
+            data = reader.poll()
+            if data is None or data.timestamp == last_timestamp:
+                plt.pause(FEED_POLL_INTERVAL_SEC)
+                continue
+            last_timestamp = data.timestamp
+            detection_data.update(
+                data.blendshape_names,
+                data.blendshape_scores,
+                data.image,
+                data.timestamp,
+                data.landmarks,
+            )
+            detection_data.update_parameters(
+                data.parameter_names, data.parameter_values
+            )
+            update_figure(fig, axs, detection_data)
+            if data.compute_level is not None:
+                fig.suptitle(
+                    f"Current timestamp: {data.timestamp}, compute budget level {data.compute_level} ({data.compute_cost_ms:.2f} ms per frame)"
+                )
+            plt.pause(FEED_POLL_INTERVAL_SEC)
+    except KeyboardInterrupt:
+        print("Quitting")
+
+    reader.close()
+
+
 if __name__ == "__main__":
     args = get_args()
-    debug_visualize(args)
+    if args.attach:
+        debug_visualize_attached(args)
+    else:
+        debug_visualize(args)
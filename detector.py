@@ -0,0 +1,122 @@
+import mediapipe as mp
+from mediapipe.tasks import python
+from mediapipe.tasks.python import vision
+
+from threading import Event
+import time
+import numpy as np
+
+from frame_clock import monotonic_ms
+from parallel_detection import DetectorPool
+
+WARM_UP_RESULT_TIMEOUT_SEC = 5
+
+
+# Reads the model once so detectors can be created from memory with
+# model_asset_buffer instead of reading the file each time
+def load_model(model_path):
+    with open(model_path, "rb") as model_file:
+        return model_file.read()
+
+
+# Passes detector results to whichever handler is currently set, so the same
+# detector can be warmed up before the real result handler is ready.
+# Also reports how long the first result with a face took, since the landmark
+# and blendshape models only run once a face has been found.
+class ResultDispatcher:
+    def __init__(self, handler=None):
+        self.handler = handler
+        self.face_found = False
+
+    def __call__(self, detection_result, image, timestamp_ms):
+        if not self.face_found and len(detection_result.face_landmarks) > 0:
+            self.face_found = True
+            print(f"First face result {monotonic_ms() - timestamp_ms} ms after capture")
+        handler = self.handler
+        if handler is not None:
+            handler(detection_result, image, timestamp_ms)
+
+
+# Creates a live stream face landmarker, or a pool of detector processes if
+# workers > 0. Either way results are passed to result_callback.
+# outputs is (blendshapes, transformation matrixes), the optional outputs to compute.
+def create_detector(args, result_callback, model_buffer, outputs=(True, True)):
+    if args.workers > 0:
+        return DetectorPool(
+            model_buffer,
+            args.use_gpu,
+            outputs,
+            args.workers,
+            result_callback,
+            args.reorder_wait_ms / 1000,
+        )
+
+    delagate = python.BaseOptions.Delegate.CPU
+    if args.use_gpu:
+        delagate = python.BaseOptions.Delegate.GPU
+
+    base_options = python.BaseOptions(
+        model_asset_buffer=model_buffer, delegate=delagate
+    )
+
+    options = vision.FaceLandmarkerOptions(
+        base_options,
+        running_mode=mp.tasks.vision.RunningMode.LIVE_STREAM,
+        output_face_blendshapes=outputs[0],
+        output_facial_transformation_matrixes=outputs[1],
+        num_faces=1,
+        result_callback=result_callback,
+    )
+
+    return vision.FaceLandmarker.create_from_options(options)
+
+
+def submit_frame(detector, frame, timestamp_ms):
+    if isinstance(detector, DetectorPool):
+        # worker processes wrap the frame themselves
+        detector.detect_async(frame, timestamp_ms)
+    else:
+        image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame)
+        detector.detect_async(image, timestamp_ms)
+
+
+# Runs synthetic frames through the detector one at a time so the graph is
+# initialized before real frames arrive, and reports how long results took.
+# The frames contain no face, so only face detection is warmed up; the landmark
+# and blendshape models first run on the first real face.
+# Results are consumed here and not passed on to the dispatcher's handler.
+def warm_up(detector, dispatcher, frame_clock, frame_shape, frames):
+    if frames <= 0:
+        return
+    result_received = Event()
+
+    def warm_up_result(detection_result, image, timestamp_ms):
+        result_received.set()
+
+    handler = dispatcher.handler
+    dispatcher.handler = warm_up_result
+    if isinstance(detector, DetectorPool):
+        # warm every worker, and keep slow first results from being skipped
+        frames *= len(detector.processes)
+        max_wait_sec = detector.reorder_buffer.max_wait_sec
+        detector.reorder_buffer.max_wait_sec = WARM_UP_RESULT_TIMEOUT_SEC
+
+    # noise rather than a flat image so the face detector does real work
+    frame = np.random.default_rng(0).integers(0, 256, frame_shape, dtype=np.uint8)
+    latencies = []
+    for _ in range(frames):
+        result_received.clear()
+        start = time.perf_counter()
+        submit_frame(detector, frame, frame_clock.timestamp())
+        if not result_received.wait(WARM_UP_RESULT_TIMEOUT_SEC):
+            print("Warm up frame timed out")
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    dispatcher.handler = handler
+    if isinstance(detector, DetectorPool):
+        detector.reorder_buffer.max_wait_sec = max_wait_sec
+
+    if len(latencies) > 0:
+        print(
+            f"Face detection warm up: first result after {latencies[0]:.1f} ms, last {latencies[-1]:.1f} ms over {len(latencies)} frames"
+        )
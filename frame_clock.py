@@ -0,0 +1,55 @@
+from threading import Lock
+import time
+
+
+def monotonic_ms():
+    # CLOCK_MONOTONIC is shared by every process on the machine, so timestamps
+    # from the capture process can be compared against clocks in other processes
+    return time.monotonic_ns() // 1_000_000
+
+
+# Timestamps frames at capture time. Cameras often report 0 or jumps backwards
+# for CAP_PROP_POS_MSEC, and mediapipe rejects non-increasing timestamps, so
+# these come from the monotonic clock and are bumped to stay strictly increasing.
+class FrameClock:
+    def __init__(self):
+        self.last_timestamp = -1
+
+    def timestamp(self):
+        timestamp = monotonic_ms()
+        if timestamp <= self.last_timestamp:
+            timestamp = self.last_timestamp + 1
+        self.last_timestamp = timestamp
+        return timestamp
+
+
+# Tracks how old frames are at each stage of the pipeline, and drops frames
+# that are older than the latency budget so work is never spent on a backlog.
+# A budget of 0 disables dropping but still tracks ages.
+class FrameAgeTracker:
+    def __init__(self, budget_ms):
+        self.lock = Lock()
+        self.budget_ms = budget_ms
+        self.stages = {}
+
+    # Returns True if the frame captured at timestamp_ms is fresh enough to continue
+    def check(self, stage, timestamp_ms):
+        age = max(monotonic_ms() - timestamp_ms, 0)
+        fresh = self.budget_ms <= 0 or age <= self.budget_ms
+        with self.lock:
+            stats = self.stages.setdefault(stage, [0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += age
+            stats[2] = max(stats[2], age)
+            if not fresh:
+                stats[3] += 1
+        return fresh
+
+    def summary(self):
+        lines = []
+        with self.lock:
+            for stage, (count, total_age, max_age, dropped) in self.stages.items():
+                lines.append(
+                    f"{stage}: {count} frames, mean age {total_age / count:.1f} ms, max age {max_age} ms, {dropped} dropped"
+                )
+        return "\n".join(lines)
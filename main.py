@@ -1,10 +1,4 @@
 import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-
-from websockets.sync.client import connect
-
-from threading import Lock
 
 import time
 import cv2
@@ -12,31 +6,34 @@ import os
 import json
 import argparse
 
-from vtube_studio_interface import (
-    get_authentication_token,
-    vtube_studio_authenticate,
-    send_detection_results,
-)
+from vtube_studio_interface import compute_detection_params
 from create_parameters import create_custom_parameters
+from param_expressions import ExpressionError, ExpressionWatcher
+from compute_params import detector_outputs, enabled_parameters, parameter_features
+from detector import (
+    ResultDispatcher,
+    create_detector,
+    load_model,
+    submit_frame,
+    warm_up,
+)
+from camera import open_camera
+from frame_clock import FrameClock, FrameAgeTracker
+from multiprocess_pipeline import run_multiprocess
+from param_history import DetectionHistory
+from debug_feed import DebugFeedPublisher
+from compute_budget import ComputeBudget
+from compute_landmark_params import LandmarkRegionCache
+from sampling_profiler import create_profiler
+from output_sinks import (
+    create_udp_sinks,
+    create_vtube_studio_destinations,
+    parameter_vector,
+)
 
-
-class ResultTracker:
-    def __init__(self, max_failures):
-        self.lock = Lock()
-        self.failures = 0
-        self.max_failures = max_failures
-
-    def add_failure(self):
-        with self.lock:
-            self.failures += 1
-
-    def reset(self):
-        with self.lock:
-            self.failures = 0
-
-    def is_disconnected(self):
-        with self.lock:
-            return self.failures > self.max_failures
+DEFAULT_ADDRESS = "ws://localhost:8001"
+# results per second the history is sized for, whatever --fps was asked for
+HISTORY_MAX_RATE = 120
 
 
 def get_args():
@@ -47,8 +44,9 @@ def get_args():
     parser.add_argument(
         "-a",
         "--auth_file",
-        help="json file containing vtube studio auth token",
-        default="auth.json",
+        help="json file containing vtube studio auth token, one per --address (default: auth.json, auth2.json, ...)",
+        action="append",
+        default=None,
     )
     parser.add_argument(
         "-m",
@@ -57,7 +55,10 @@ def get_args():
         default="face_landmarker_v2_with_blendshapes.task",
     )
     parser.add_argument(
-        "--address", help="API address for VTube Studio", default="ws://localhost:8001"
+        "--address",
+        help=f"API address for VTube Studio, can be repeated to send to several instances (default: {DEFAULT_ADDRESS})",
+        action="append",
+        default=None,
     )
     parser.add_argument("-c", "--camera", help="index of camera device", default=0)
     parser.add_argument("-W", "--width", help="width of camera image", default=1280)
@@ -74,106 +75,351 @@ def get_args():
         help="Number of failed communications to vtube studio before quitting",
         default=5,
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "-p",
+        "--params-file",
+        help="parameter expression file, reloaded when it changes (default: formulas in compute_params.py)",
+        default=None,
+    )
+    parser.add_argument(
+        "--disable-params",
+        help="comma separated parameters not to compute or send, features only they use are skipped",
+        default="",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        help="number of detector processes sharing frames round robin (default: single live stream detector)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--reorder-wait-ms",
+        help="with --workers, how long to wait for a late result before skipping that frame",
+        type=float,
+        default=100,
+    )
+    parser.add_argument(
+        "--multiprocess",
+        help="run capture and sending to vtube studio in separate processes, sharing frames and parameters through shared memory",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--latency-budget-ms",
+        help="drop frames older than this at any stage of the pipeline, 0 to never drop",
+        type=float,
+        default=200,
+    )
+    parser.add_argument(
+        "--compute-budget-ms",
+        help="when computing parameters takes longer than this per frame, update cheek puff and eye openness less often, 0 to disable",
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        "--landmark-epsilon",
+        help="reuse hull and ellipse metrics of a face region while none of its landmarks have moved this far (normalized image units), 0 to always recompute",
+        type=float,
+        default=0.0005,
+    )
+    parser.add_argument(
+        "--warm-up-frames",
+        help="number of synthetic frames to run through the detector before connecting",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--history-seconds",
+        help="seconds of blendshape and parameter history to keep in memory, 0 to disable",
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "--history-file",
+        help="save the parameter history to this .npz file on exit",
+        default=None,
+    )
+    parser.add_argument(
+        "--osc",
+        help="also send parameters as OSC messages over UDP to host:port, can be repeated",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--osc-prefix",
+        help="address prefix for OSC parameter messages",
+        default="/avatar/parameters",
+    )
+    parser.add_argument(
+        "--vmc",
+        help="also send parameters as VMC protocol blend shapes over UDP to host:port, can be repeated",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--debug-feed",
+        help="publish frames, landmarks and parameters for debug_visualize.py --attach",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--debug-feed-rate",
+        help="maximum updates per second of the debug feed",
+        type=float,
+        default=15,
+    )
+    parser.add_argument(
+        "--debug-feed-name",
+        help="name of the debug feed shared memory",
+        default="lilac_debug",
+    )
+    parser.add_argument(
+        "--profile-seconds",
+        help="length of a sampling profile, started by sending SIGUSR1 or a 'profile [seconds]' command to --profile-port",
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        "--profile-interval-ms",
+        help="time between stack samples while profiling",
+        type=float,
+        default=5,
+    )
+    parser.add_argument(
+        "--profile-port",
+        help="listen on this localhost TCP port for profile commands, 0 to disable",
+        type=int,
+        default=0,
+    )
+    args = parser.parse_args()
+    if args.address is None:
+        args.address = [DEFAULT_ADDRESS]
+    if args.auth_file is None:
+        args.auth_file = ["auth.json"] + [
+            f"auth{idx + 1}.json" for idx in range(1, len(args.address))
+        ]
+    if len(args.auth_file) != len(args.address):
+        parser.error("give one --auth_file for each --address")
+    return args
 
 
-def main(auth_token, args):
-    # webcam reader
-    # make these parameters?
-    camera_id = args.camera
-    width = args.width
-    height = args.height
-    fps = args.fps
-
-    capture = cv2.VideoCapture()
-    capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-    capture.set(cv2.CAP_PROP_FPS, fps)
-    capture.open(camera_id)
-    time.sleep(0.02)  # allow camera to initialize
-
-    if capture.isOpened() == False:
-        print("Device not opened")
-        exit(1)
+# Reads the auth token for each address, asking VTube Studio for a new one and
+# creating the custom parameters if there is none yet
+def load_auth_tokens(args):
+    auth_tokens = []
+    for address, auth_file_name in zip(args.address, args.auth_file):
+        auth_token = ""
+        if os.path.isfile(auth_file_name):
+            with open(auth_file_name, "r") as auth_file:
+                auth_data = json.load(auth_file)
+                auth_token = auth_data["auth_token"]
+        if auth_token == "":
+            try:
+                auth_token = create_custom_parameters(
+                    auth_token, auth_file_name, address
+                )
+            except Exception as e:
+                # the destination will fail to authorize and be disconnected
+                print(f"Unable to get an auth token from {address}: {e}")
+                auth_token = ""
+        auth_tokens.append(auth_token)
+    return auth_tokens
 
-    attempts = 0
-    result_tracker = ResultTracker(args.websocket_failures)
 
-    with connect(args.address) as websocket:
-        # authenticate session
+def create_history(args):
+    if args.history_seconds <= 0:
+        return None
+    # cameras can run faster than --fps, and the history is read by timestamp,
+    # so size it for the fastest expected result rate
+    rate = max(float(args.fps), HISTORY_MAX_RATE)
+    return DetectionHistory(max(int(args.history_seconds * rate), 1))
+
+
+def report_history(history, args):
+    if history is None:
+        return
+    print(history.summary(args.history_seconds))
+    if args.history_file is not None:
+        history.save(args.history_file, args.history_seconds)
+
+
+def create_compute_budget(args):
+    if args.compute_budget_ms <= 0:
+        return None
+    return ComputeBudget(args.compute_budget_ms)
+
+
+def create_region_cache(args):
+    if args.landmark_epsilon <= 0:
+        return None
+    return LandmarkRegionCache(args.landmark_epsilon)
+
+
+def create_debug_feed(args, compute_budget):
+    if not args.debug_feed:
+        return None
+    return DebugFeedPublisher(
+        args.debug_feed_name, args.debug_feed_rate, compute_budget
+    )
+
+
+def main(auth_tokens, args):
+    create_profiler(args)
+    disabled = [name.strip() for name in args.disable_params.split(",") if name.strip()]
+    parameters = None
+    expression_watcher = None
+    if args.params_file is not None:
         try:
-            if auth_token == "":
-                auth_token = get_authentication_token(websocket)
-            vtube_studio_authenticate(websocket, auth_token)
-        except:
-            print("Unable to authorize")
+            expression_watcher = ExpressionWatcher(args.params_file, disabled)
+        except (OSError, ExpressionError) as e:
+            print(f"Unable to load parameter file: {e}")
             exit(1)
+        outputs = detector_outputs(expression_watcher.program.features)
 
-        def process_results(
-            detection_result: mp.tasks.vision.FaceLandmarkerResult,
-            image: mp.Image,
-            timestamp_ms: int,
-        ):
-            result = send_detection_results(detection_result, websocket)
-            if result != True:
-                result_tracker.add_failure()
-            else:
-                result_tracker.reset()
+        def check_outputs(program):
+            needed = detector_outputs(program.features)
+            if any(need and not enabled for need, enabled in zip(needed, outputs)):
+                print(
+                    "Reloaded parameters use blendshapes or head pose that the detector was started without, restart to enable them"
+                )
 
-        delagate = python.BaseOptions.Delegate.CPU
-        if args.use_gpu:
-            delagate = python.BaseOptions.Delegate.GPU
+        expression_watcher.on_reload = check_outputs
+        expression_watcher.start()
+    else:
+        parameters = enabled_parameters(disabled)
+        outputs = detector_outputs(parameter_features(parameters))
 
-        base_options = python.BaseOptions(
-            model_asset_path=args.model, delegate=delagate
+    try:
+        model_buffer = load_model(args.model)
+    except OSError as e:
+        print(f"Unable to load model: {e}")
+        exit(1)
+
+    compute_budget = create_compute_budget(args)
+    region_cache = create_region_cache(args)
+    if args.multiprocess:
+        history = create_history(args)
+        debug_feed = create_debug_feed(args, compute_budget)
+        run_multiprocess(
+            auth_tokens,
+            args,
+            expression_watcher,
+            parameters,
+            compute_budget,
+            region_cache,
+            outputs,
+            model_buffer,
+            history,
+            debug_feed,
         )
+        if debug_feed is not None:
+            debug_feed.close()
+        if compute_budget is not None:
+            print(compute_budget.summary())
+        if region_cache is not None:
+            print(region_cache.summary())
+        report_history(history, args)
+        return
 
-        options = vision.FaceLandmarkerOptions(
-            base_options,
-            running_mode=mp.tasks.vision.RunningMode.LIVE_STREAM,
-            output_face_blendshapes=True,
-            output_facial_transformation_matrixes=True,
-            num_faces=1,
-            result_callback=process_results,
+    # webcam reader
+    capture = open_camera(args)
+
+    attempts = 0
+    frame_clock = FrameClock()
+    age_tracker = FrameAgeTracker(args.latency_budget_ms)
+    history = create_history(args)
+    udp_sinks = create_udp_sinks(args)
+    debug_feed = create_debug_feed(args, compute_budget)
+
+    # warm up the detector before connecting, results are handled once connected
+    dispatcher = ResultDispatcher()
+    detector = create_detector(args, dispatcher, model_buffer, outputs)
+    frame_shape = (
+        int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        3,
+    )
+    warm_up(detector, dispatcher, frame_clock, frame_shape, args.warm_up_frames)
+
+    # each destination authenticates its own session and sends from its own thread
+    destinations = create_vtube_studio_destinations(args, auth_tokens)
+
+    def process_results(
+        detection_result: mp.tasks.vision.FaceLandmarkerResult,
+        image: mp.Image,
+        timestamp_ms: int,
+    ):
+        if not age_tracker.check("result", timestamp_ms):
+            return
+        program = None
+        if expression_watcher is not None:
+            program = expression_watcher.program
+        request = compute_detection_params(
+            detection_result, program, parameters, compute_budget, region_cache
         )
+        if request is None:
+            # Do nothing if no shapes found
+            if debug_feed is not None:
+                debug_feed.publish_result(timestamp_ms, detection_result, [], [])
+            return
+        if history is not None:
+            history.record(timestamp_ms, detection_result, request)
+        names, values = parameter_vector(request)
+        if debug_feed is not None:
+            debug_feed.publish_result(timestamp_ms, detection_result, names, values)
+        if not age_tracker.check("send", timestamp_ms):
+            return
+        for sink in udp_sinks:
+            sink.send(names, values)
+        for destination in destinations:
+            destination.send(names, values, timestamp_ms)
 
-        detector = vision.FaceLandmarker.create_from_options(options)
-        fps = capture.get(cv2.CAP_PROP_FPS)
-        wait_interval_sec = 0.1 / fps  # wait 10% of the time to get a frame
+    dispatcher.handler = process_results
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    wait_interval_sec = 0.1 / fps  # wait 10% of the time to get a frame
 
-        try:
-            while True:
-                # Load image
-                ret, cv2_image = capture.read()
-
-                if result_tracker.is_disconnected():
-                    print("No longer recieving from server, disconnecting!")
-                    break
-
-                if ret:
-                    attempts = 0
-                    image = mp.Image(image_format=mp.ImageFormat.SRGB, data=cv2_image)
-                    timestamp = int(capture.get(cv2.CAP_PROP_POS_MSEC))
-                    detector.detect_async(image, timestamp)
-                else:
-                    attempts += 1
-                    time.sleep(wait_interval_sec)
-                if attempts > args.camera_failures:
-                    print("Too many failed attempts getting camera image, quitting")
-                    break
-        except KeyboardInterrupt:
-            print("Quitting")
+    try:
+        while True:
+            # Load image
+            ret, cv2_image = capture.read()
+
+            if all(destination.is_disconnected() for destination in destinations):
+                print("No longer recieving from any server, disconnecting!")
+                break
+
+            if ret:
+                attempts = 0
+                timestamp = frame_clock.timestamp()
+                submit_frame(detector, cv2_image, timestamp)
+                if debug_feed is not None:
+                    debug_feed.publish_frame(cv2_image, timestamp)
+            else:
+                attempts += 1
+                time.sleep(wait_interval_sec)
+            if attempts > args.camera_failures:
+                print("Too many failed attempts getting camera image, quitting")
+                break
+    except KeyboardInterrupt:
+        print("Quitting")
+    detector.close()
+    for sink in udp_sinks:
+        sink.close()
+    if debug_feed is not None:
+        debug_feed.close()
+    for destination in destinations:
+        destination.close()
     capture.release()
+    print(age_tracker.summary())
+    if compute_budget is not None:
+        print(compute_budget.summary())
+    if region_cache is not None:
+        print(region_cache.summary())
+    for destination in destinations:
+        print(destination.summary())
+    report_history(history, args)
 
 
 if __name__ == "__main__":
     args = get_args()
-
-    auth_token = ""
-    if os.path.isfile(args.auth_file):
-        with open("auth.json", "r") as auth_file:
-            auth_data = json.load(auth_file)
-            auth_token = auth_data["auth_token"]
-    if auth_token == "":
-        auth_token = create_custom_parameters(auth_token, args.auth_file)
-    main(auth_token, args)
+    main(load_auth_tokens(args), args)
@@ -0,0 +1,266 @@
+import mediapipe as mp
+
+import multiprocessing
+import queue
+import time
+import cv2
+import numpy as np
+
+from camera import open_camera
+from detector import ResultDispatcher, create_detector, submit_frame, warm_up
+from frame_clock import FrameClock, FrameAgeTracker
+from parallel_detection import DetectorPool
+from shared_ring import SharedRing
+from output_sinks import (
+    create_udp_sinks,
+    create_vtube_studio_destinations,
+    parameter_vector,
+)
+from vtube_studio_interface import compute_detection_params
+from sampling_profiler import create_profiler
+
+FRAME_RING_SLOTS = 4
+PARAMETER_RING_SLOTS = 8
+MAX_PARAMETERS = 128
+POLL_INTERVAL_SEC = 0.001
+STARTUP_TIMEOUT_SEC = 10
+
+
+# Capture stage: reads the camera and writes frames into a shared ring.
+# The ring is created once the first frame shows the real frame size, and its
+# attach arguments are sent back through ring_queue.
+def capture_process(args, ring_queue, stop_event):
+    create_profiler(args, control=False)
+    capture = open_camera(args)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    wait_interval_sec = 0.1 / fps  # wait 10% of the time to get a frame
+
+    ring = None
+    attempts = 0
+    frame_clock = FrameClock()
+    try:
+        while not stop_event.is_set():
+            ret, cv2_image = capture.read()
+            if ret:
+                attempts = 0
+                if ring is None:
+                    ring = SharedRing(
+                        cv2_image.shape, cv2_image.dtype, FRAME_RING_SLOTS, create=True
+                    )
+                    ring_queue.put(ring.attach_args())
+                ring.write(cv2_image, frame_clock.timestamp())
+            else:
+                attempts += 1
+                time.sleep(wait_interval_sec)
+            if attempts > args.camera_failures:
+                print("Too many failed attempts getting camera image, quitting")
+                break
+    except KeyboardInterrupt:
+        pass
+    capture.release()
+    if ring is not None:
+        ring.close()
+
+
+# Send stage: forwards the newest parameter vector to every vtube studio
+# destination and any UDP sinks. Each destination sends from its own thread and
+# coalesces vectors that arrive while it is busy into the newest.
+def sender_process(args, auth_tokens, ring_args, names_queue, stop_event):
+    create_profiler(args, control=False)
+    ring = SharedRing.attach(*ring_args)
+    age_tracker = FrameAgeTracker(args.latency_budget_ms)
+    udp_sinks = create_udp_sinks(args)
+    destinations = create_vtube_studio_destinations(args, auth_tokens)
+    names = {}
+    last_sequence = ring.latest_sequence()
+
+    try:
+        while not stop_event.is_set():
+            if all(destination.is_disconnected() for destination in destinations):
+                print("No longer recieving from any server, disconnecting!")
+                break
+            sequence = ring.latest_sequence()
+            if sequence == last_sequence:
+                time.sleep(POLL_INTERVAL_SEC)
+                continue
+            last_sequence = sequence
+
+            entry = ring.read(sequence)
+            if entry is None:
+                continue
+            timestamp, vector = entry
+            version = int(vector[0])
+            values = vector[2 : 2 + int(vector[1])].tolist()
+            if not ring.is_valid(sequence):
+                continue  # overwritten while reading
+            if not age_tracker.check("send", timestamp):
+                continue
+
+            # names are always queued before the first vector using them
+            while version not in names:
+                names.update([names_queue.get()])
+
+            for sink in udp_sinks:
+                sink.send(names[version], values)
+            for destination in destinations:
+                destination.send(names[version], values, timestamp)
+    except KeyboardInterrupt:
+        pass
+    for sink in udp_sinks:
+        sink.close()
+    for destination in destinations:
+        destination.close()
+    ring.close()
+    print(age_tracker.summary())
+    for destination in destinations:
+        print(destination.summary())
+
+
+# Packs parameter requests into fixed size vectors for the parameter ring:
+# [names version, parameter count, values...]
+# Parameter names only change when the expression file is reloaded, so they
+# are sent separately, once per version.
+class ParameterVectorWriter:
+    def __init__(self, ring, names_queue):
+        self.ring = ring
+        self.names_queue = names_queue
+        self.names = None
+        self.version = 0
+        self.vector = np.zeros(2 + MAX_PARAMETERS)
+
+    def write(self, request, timestamp):
+        parameter_values = request["data"]["parameterValues"][:MAX_PARAMETERS]
+        names = tuple(parameter["id"] for parameter in parameter_values)
+        if names != self.names:
+            self.version += 1
+            self.names = names
+            self.names_queue.put((self.version, names))
+        self.vector[0] = self.version
+        self.vector[1] = len(names)
+        self.vector[2 : 2 + len(names)] = [
+            parameter["value"] for parameter in parameter_values
+        ]
+        self.ring.write(self.vector, timestamp)
+
+
+def wait_for_frame_ring(ring_queue, capture):
+    start = time.monotonic()
+    while time.monotonic() - start < STARTUP_TIMEOUT_SEC:
+        try:
+            return SharedRing.attach(*ring_queue.get(timeout=0.1))
+        except queue.Empty:
+            if not capture.is_alive():
+                break
+    return None
+
+
+# Runs capture and sending in their own processes, with detection and the
+# parameter math in this one. Frames are read from the capture ring without
+# copying; with several slots the newest slot is not overwritten while it is
+# handed to the detector.
+def run_multiprocess(
+    auth_tokens,
+    args,
+    expression_watcher,
+    parameters,
+    compute_budget,
+    region_cache,
+    outputs,
+    model_buffer,
+    history,
+    debug_feed,
+):
+    # warm up the detector before starting the other stages
+    dispatcher = ResultDispatcher()
+    detector = create_detector(args, dispatcher, model_buffer, outputs)
+    frame_shape = (int(args.height), int(args.width), 3)
+    warm_up(detector, dispatcher, FrameClock(), frame_shape, args.warm_up_frames)
+
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+
+    ring_queue = context.Queue()
+    capture = context.Process(
+        target=capture_process, args=(args, ring_queue, stop_event), daemon=True
+    )
+    capture.start()
+
+    parameter_ring = SharedRing(
+        (2 + MAX_PARAMETERS,), np.float64, PARAMETER_RING_SLOTS, create=True
+    )
+    names_queue = context.Queue()
+    sender = context.Process(
+        target=sender_process,
+        args=(args, auth_tokens, parameter_ring.attach_args(), names_queue, stop_event),
+        daemon=True,
+    )
+    sender.start()
+
+    frame_ring = wait_for_frame_ring(ring_queue, capture)
+    if frame_ring is None:
+        print("No frames received from capture process, quitting")
+        stop_event.set()
+        detector.close()
+        parameter_ring.close()
+        exit(1)
+
+    vector_writer = ParameterVectorWriter(parameter_ring, names_queue)
+    age_tracker = FrameAgeTracker(args.latency_budget_ms)
+
+    def process_results(
+        detection_result: mp.tasks.vision.FaceLandmarkerResult,
+        image: mp.Image,
+        timestamp_ms: int,
+    ):
+        if not age_tracker.check("result", timestamp_ms):
+            return
+        program = None
+        if expression_watcher is not None:
+            program = expression_watcher.program
+        request = compute_detection_params(
+            detection_result, program, parameters, compute_budget, region_cache
+        )
+        if request is None:
+            if debug_feed is not None:
+                debug_feed.publish_result(timestamp_ms, detection_result, [], [])
+            return
+        if history is not None:
+            history.record(timestamp_ms, detection_result, request)
+        if debug_feed is not None:
+            names, values = parameter_vector(request)
+            debug_feed.publish_result(timestamp_ms, detection_result, names, values)
+        vector_writer.write(request, timestamp_ms)
+
+    dispatcher.handler = process_results
+    last_sequence = -1
+    try:
+        while capture.is_alive() and sender.is_alive():
+            sequence = frame_ring.latest_sequence()
+            if sequence == last_sequence:
+                time.sleep(POLL_INTERVAL_SEC)
+                continue
+            last_sequence = sequence
+            entry = frame_ring.read(sequence)
+            if entry is None:
+                continue
+            timestamp, frame = entry
+            if isinstance(detector, DetectorPool):
+                # the worker queues pickle frames later, when the slot may
+                # already hold a newer frame, so send a checked copy instead
+                frame = np.copy(frame)
+                if not frame_ring.is_valid(sequence):
+                    continue
+            if age_tracker.check("submit", timestamp):
+                submit_frame(detector, frame, timestamp)
+                if debug_feed is not None:
+                    debug_feed.publish_frame(frame, timestamp)
+    except KeyboardInterrupt:
+        print("Quitting")
+
+    stop_event.set()
+    detector.close()
+    capture.join(timeout=1)
+    sender.join(timeout=1)
+    frame_ring.close()
+    parameter_ring.close()
+    print(age_tracker.summary())
@@ -0,0 +1,275 @@
+from websockets.sync.client import connect
+
+from threading import Condition, Event, Thread
+import socket
+import struct
+import time
+
+from frame_clock import FrameAgeTracker
+from vtube_studio_interface import (
+    create_parameter_request,
+    send_parameter_request,
+    vtube_studio_authenticate,
+)
+
+OSC_FLOAT = struct.Struct(">f")
+OSC_INT = struct.Struct(">i")
+OSC_IMMEDIATE = struct.pack(">Q", 1)
+VMC_BLEND_VALUE = "/VMC/Ext/Blend/Val"
+VMC_BLEND_APPLY = "/VMC/Ext/Blend/Apply"
+CONNECT_TIMEOUT_SEC = 5
+
+
+def osc_string(value):
+    data = value.encode() + b"\0"
+    return data + b"\0" * (-len(data) % 4)
+
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    # allow [::1]:9000 for IPv6 addresses
+    return (host.strip("[]"), int(port))
+
+
+# Packed OSC bundle that is built once per set of parameter names.
+# Each message is (bytes before its float arguments, number of floats); sending
+# only packs the new float values into the existing buffer.
+class OscBundleTemplate:
+    def __init__(self, messages):
+        parts = [osc_string("#bundle"), OSC_IMMEDIATE]
+        self.offsets = []
+        offset = sum(len(part) for part in parts)
+        for head, floats in messages:
+            parts.append(OSC_INT.pack(len(head) + 4 * floats))
+            parts.append(head)
+            parts.append(b"\0" * (4 * floats))
+            offset += 4 + len(head)
+            for _ in range(floats):
+                self.offsets.append(offset)
+                offset += 4
+        self.buffer = bytearray(b"".join(parts))
+
+    def pack(self, values):
+        for offset, value in zip(self.offsets, values):
+            OSC_FLOAT.pack_into(self.buffer, offset, value)
+        return self.buffer
+
+
+# One OSC message per parameter, addressed as <prefix>/<parameter name>
+def osc_messages(prefix, names):
+    type_tags = osc_string(",f")
+    return [(osc_string(f"{prefix}/{name}") + type_tags, 1) for name in names]
+
+
+# Virtual Motion Capture protocol: a blend shape value per parameter, then apply
+def vmc_messages(names):
+    head = osc_string(VMC_BLEND_VALUE) + osc_string(",sf")
+    messages = [(head + osc_string(name), 1) for name in names]
+    messages.append((osc_string(VMC_BLEND_APPLY) + osc_string(","), 0))
+    return messages
+
+
+# Fire and forget UDP output, nothing waits for a reply.
+# messages builds the OscBundleTemplate messages for a list of parameter names.
+# The host name is resolved once here so sending never does a lookup.
+class UdpSink:
+    def __init__(self, address, messages):
+        host, port = parse_address(address)
+        family, socket_type, proto, _, self.address = socket.getaddrinfo(
+            host, port, type=socket.SOCK_DGRAM
+        )[0]
+        self.socket = socket.socket(family, socket_type, proto)
+        self.socket.setblocking(False)
+        self.messages = messages
+        self.names = None
+        self.template = None
+        self.errors = 0
+
+    def send(self, names, values):
+        if names != self.names:
+            self.names = list(names)
+            self.template = OscBundleTemplate(self.messages(names))
+        try:
+            self.socket.sendto(self.template.pack(values), self.address)
+        except OSError:
+            # includes a full socket buffer, the frame is just lost
+            self.errors += 1
+            return False
+        return True
+
+    def close(self):
+        self.socket.close()
+
+
+class OscSink(UdpSink):
+    def __init__(self, address, prefix="/avatar/parameters"):
+        prefix = prefix.rstrip("/")
+        super().__init__(address, lambda names: osc_messages(prefix, names))
+
+
+class VmcSink(UdpSink):
+    def __init__(self, address):
+        super().__init__(address, vmc_messages)
+
+
+# A reply that takes longer than timeout counts as a failed send, so an instance
+# that stops replying without closing the connection is eventually disconnected.
+class VTubeStudioSink:
+    def __init__(self, websocket, timeout=None):
+        self.websocket = websocket
+        self.timeout = timeout
+
+    def send(self, names, values):
+        request = create_parameter_request()
+        request["data"]["parameterValues"] = [
+            {"id": name, "value": value} for name, value in zip(names, values)
+        ]
+        return send_parameter_request(request, self.websocket, self.timeout)
+
+    def close(self):
+        pass
+
+
+# One VTube Studio instance with its own authenticated session and sender thread.
+# The sender thread also connects and authenticates, so an unreachable instance
+# only disconnects itself. Only the newest parameter values are kept: values
+# that arrive while a send is still waiting for its reply replace the pending
+# ones, so a slow destination skips frames instead of queueing them and never
+# holds back the caller or the other destinations. After more than max_failures
+# failed sends in a row the destination disconnects and ignores further values.
+class VTubeStudioDestination:
+    def __init__(self, address, auth_token, max_failures, latency_budget_ms):
+        self.address = address
+        self.auth_token = auth_token
+        self.max_failures = max_failures
+        self.age_tracker = FrameAgeTracker(latency_budget_ms)
+        self.condition = Condition()
+        self.pending = None
+        self.closed = False
+        self.disconnected = False
+        self.connected = Event()
+        self.websocket = None
+        self.failures = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.thread = Thread(target=self.run, name=f"sender {address}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def connect(self):
+        try:
+            self.websocket = connect(self.address, open_timeout=CONNECT_TIMEOUT_SEC)
+            vtube_studio_authenticate(
+                self.websocket, self.auth_token, CONNECT_TIMEOUT_SEC
+            )
+        except Exception as e:
+            return self.connect_failed(e)
+        self.connected.set()
+        return True
+
+    def connect_failed(self, reason):
+        print(f"Unable to authorize with {self.address}: {reason}")
+        if self.websocket is not None:
+            self.websocket.close()
+        with self.condition:
+            self.disconnected = True
+        return False
+
+    def send(self, names, values, timestamp_ms):
+        with self.condition:
+            if self.disconnected:
+                return
+            if self.pending is not None:
+                self.coalesced += 1
+            self.pending = (names, values, timestamp_ms)
+            self.condition.notify()
+
+    def run(self):
+        if not self.connect():
+            return
+        sink = VTubeStudioSink(self.websocket, CONNECT_TIMEOUT_SEC)
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    break
+                names, values, timestamp_ms = self.pending
+                self.pending = None
+            if not self.age_tracker.check(self.address, timestamp_ms):
+                continue
+            if sink.send(names, values):
+                self.failures = 0
+                self.sent += 1
+            else:
+                self.failures += 1
+            if self.failures > self.max_failures:
+                print(f"No longer recieving from {self.address}, disconnecting!")
+                with self.condition:
+                    self.disconnected = True
+                break
+        self.websocket.close()
+
+    def is_disconnected(self):
+        return self.disconnected
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join(timeout=1)
+
+    def summary(self):
+        lines = [
+            f"{self.address}: {self.sent} sent, {self.coalesced} replaced by newer values before sending"
+        ]
+        age_summary = self.age_tracker.summary()
+        if age_summary != "":
+            lines.append(age_summary)
+        return "\n".join(lines)
+
+
+# Starts a destination for every --address, using the matching auth token.
+# Returns once any of them is connected; the others keep connecting in the
+# background. Quits if none of them could connect.
+def create_vtube_studio_destinations(args, auth_tokens):
+    destinations = [
+        VTubeStudioDestination(
+            address,
+            auth_token,
+            int(args.websocket_failures),
+            args.latency_budget_ms,
+        )
+        for address, auth_token in zip(args.address, auth_tokens)
+    ]
+    for destination in destinations:
+        destination.start()
+    # connecting is bounded by CONNECT_TIMEOUT_SEC twice, to open and to authorize
+    deadline = time.monotonic() + 2 * CONNECT_TIMEOUT_SEC + 1
+    while time.monotonic() < deadline:
+        if any(destination.connected.is_set() for destination in destinations):
+            return destinations
+        if all(destination.is_disconnected() for destination in destinations):
+            break
+        time.sleep(0.01)
+    print("Unable to connect to any VTube Studio instance")
+    exit(1)
+
+
+def parameter_vector(request):
+    parameter_values = request["data"]["parameterValues"]
+    names = [parameter["id"] for parameter in parameter_values]
+    values = [parameter["value"] for parameter in parameter_values]
+    return names, values
+
+
+def create_udp_sinks(args):
+    try:
+        sinks = [OscSink(address, args.osc_prefix) for address in args.osc]
+        sinks.extend(VmcSink(address) for address in args.vmc)
+    except (OSError, ValueError) as e:
+        print(f"Invalid UDP output address: {e}")
+        exit(1)
+    return sinks
@@ -0,0 +1,167 @@
+import mediapipe as mp
+from mediapipe.tasks import python
+from mediapipe.tasks.python import vision
+
+import multiprocessing
+import queue
+import time
+from collections import deque
+from threading import Lock, Thread
+
+FRAME_QUEUE_SIZE = 2
+RESULT_POLL_SEC = 0.005
+
+
+def detector_worker(model_buffer, use_gpu, outputs, frame_queue, result_queue):
+    delegate = python.BaseOptions.Delegate.CPU
+    if use_gpu:
+        delegate = python.BaseOptions.Delegate.GPU
+
+    base_options = python.BaseOptions(
+        model_asset_buffer=model_buffer, delegate=delegate
+    )
+    options = vision.FaceLandmarkerOptions(
+        base_options,
+        running_mode=mp.tasks.vision.RunningMode.VIDEO,
+        output_face_blendshapes=outputs[0],
+        output_facial_transformation_matrixes=outputs[1],
+        num_faces=1,
+    )
+
+    with vision.FaceLandmarker.create_from_options(options) as detector:
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                break
+            sequence, timestamp, frame = item
+            image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame)
+            try:
+                result = detector.detect_for_video(image, timestamp)
+            except ValueError:
+                # mediapipe rejects non-increasing timestamps, report as missing
+                result = None
+            result_queue.put((sequence, timestamp, result))
+
+
+# Releases results in the order their frames were submitted.
+# A frame whose result has not arrived within max_wait_sec of submission is
+# skipped, and its result is dropped if it arrives afterwards.
+class ReorderBuffer:
+    def __init__(self, max_wait_sec):
+        self.lock = Lock()
+        self.max_wait_sec = max_wait_sec
+        self.submitted = deque()
+        self.results = {}
+        self.dropped = 0
+
+    def submit(self, sequence):
+        with self.lock:
+            self.submitted.append((sequence, time.monotonic()))
+
+    def cancel(self, sequence):
+        with self.lock:
+            if len(self.submitted) > 0 and self.submitted[-1][0] == sequence:
+                self.submitted.pop()
+
+    def add(self, sequence, timestamp, result):
+        with self.lock:
+            if len(self.submitted) == 0 or sequence < self.submitted[0][0]:
+                self.dropped += 1  # too late, already skipped
+                return
+            self.results[sequence] = (timestamp, result)
+
+    def pop_ready(self):
+        ready = []
+        now = time.monotonic()
+        with self.lock:
+            while len(self.submitted) > 0:
+                sequence, submit_time = self.submitted[0]
+                if sequence in self.results:
+                    ready.append(self.results.pop(sequence))
+                elif now - submit_time > self.max_wait_sec:
+                    self.dropped += 1
+                else:
+                    break
+                self.submitted.popleft()
+        return ready
+
+
+# Runs one FaceLandmarker per worker process and shares frames between them
+# round robin. Results are handed to result_callback in frame order, with the
+# same signature as a LIVE_STREAM callback (the image is not sent back).
+class DetectorPool:
+    def __init__(
+        self, model_buffer, use_gpu, outputs, workers, result_callback, max_wait_sec
+    ):
+        context = multiprocessing.get_context("spawn")
+        self.result_callback = result_callback
+        self.reorder_buffer = ReorderBuffer(max_wait_sec)
+        self.result_queue = context.Queue()
+        self.frame_queues = []
+        self.processes = []
+        for _ in range(workers):
+            frame_queue = context.Queue(maxsize=FRAME_QUEUE_SIZE)
+            process = context.Process(
+                target=detector_worker,
+                args=(model_buffer, use_gpu, outputs, frame_queue, self.result_queue),
+                daemon=True,
+            )
+            process.start()
+            self.frame_queues.append(frame_queue)
+            self.processes.append(process)
+        self.sequence = 0
+        self.skipped = 0
+        self.running = True
+        self.collector = Thread(
+            target=self.collect_results, name="detector results", daemon=True
+        )
+        self.collector.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def detect_async(self, frame, timestamp_ms):
+        sequence = self.sequence
+        self.sequence += 1
+        frame_queue = self.frame_queues[sequence % len(self.frame_queues)]
+        self.reorder_buffer.submit(sequence)
+        try:
+            frame_queue.put_nowait((sequence, timestamp_ms, frame))
+        except queue.Full:
+            # worker is behind, skip the frame rather than stalling capture
+            self.reorder_buffer.cancel(sequence)
+            self.skipped += 1
+
+    def collect_results(self):
+        while self.running:
+            try:
+                sequence, timestamp, result = self.result_queue.get(
+                    timeout=RESULT_POLL_SEC
+                )
+                self.reorder_buffer.add(sequence, timestamp, result)
+            except queue.Empty:
+                pass
+            for timestamp, result in self.reorder_buffer.pop_ready():
+                if result is not None:
+                    self.result_callback(result, None, timestamp)
+
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        for frame_queue in self.frame_queues:
+            try:
+                frame_queue.put(None, timeout=1)
+            except queue.Full:
+                pass
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self.collector.join()
+        print(
+            f"Detector pool: {self.skipped} frames skipped, {self.reorder_buffer.dropped} results dropped"
+        )
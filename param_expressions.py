@@ -0,0 +1,335 @@
+import ast
+import math
+import os
+import threading
+import time
+
+# Order matches the blendshape categories output by the face landmarker model
+BLENDSHAPE_NAMES = [
+    "_neutral",
+    "browDownLeft",
+    "browDownRight",
+    "browInnerUp",
+    "browOuterUpLeft",
+    "browOuterUpRight",
+    "cheekPuff",
+    "cheekSquintLeft",
+    "cheekSquintRight",
+    "eyeBlinkLeft",
+    "eyeBlinkRight",
+    "eyeLookDownLeft",
+    "eyeLookDownRight",
+    "eyeLookInLeft",
+    "eyeLookInRight",
+    "eyeLookOutLeft",
+    "eyeLookOutRight",
+    "eyeLookUpLeft",
+    "eyeLookUpRight",
+    "eyeSquintLeft",
+    "eyeSquintRight",
+    "eyeWideLeft",
+    "eyeWideRight",
+    "jawForward",
+    "jawLeft",
+    "jawOpen",
+    "jawRight",
+    "mouthClose",
+    "mouthDimpleLeft",
+    "mouthDimpleRight",
+    "mouthFrownLeft",
+    "mouthFrownRight",
+    "mouthFunnel",
+    "mouthLeft",
+    "mouthLowerDownLeft",
+    "mouthLowerDownRight",
+    "mouthPressLeft",
+    "mouthPressRight",
+    "mouthPucker",
+    "mouthRight",
+    "mouthRollLower",
+    "mouthRollUpper",
+    "mouthShrugLower",
+    "mouthShrugUpper",
+    "mouthSmileLeft",
+    "mouthSmileRight",
+    "mouthStretchLeft",
+    "mouthStretchRight",
+    "mouthUpperUpLeft",
+    "mouthUpperUpRight",
+    "noseSneerLeft",
+    "noseSneerRight",
+]
+
+# Metrics computed by LandmarkParamsComputer
+LANDMARK_INPUT_NAMES = [
+    "mouth_hull",
+    "cheek_puff",
+    "eye_left_open",
+    "eye_right_open",
+]
+
+# Head pose, with the same sign conventions as the FacePosition/FaceAngle parameters
+POSE_INPUT_NAMES = [
+    "position_x",
+    "position_y",
+    "position_z",
+    "angle_x",
+    "angle_y",
+    "angle_z",
+]
+
+INPUT_NAMES = BLENDSHAPE_NAMES + LANDMARK_INPUT_NAMES + POSE_INPUT_NAMES
+INPUT_INDEX = {name: idx for idx, name in enumerate(INPUT_NAMES)}
+LANDMARK_INPUT_OFFSET = len(BLENDSHAPE_NAMES)
+POSE_INPUT_OFFSET = LANDMARK_INPUT_OFFSET + len(LANDMARK_INPUT_NAMES)
+
+
+# python source templates, used for the per frame evaluator
+FRAME_OPS = {
+    "add": "{0} + {1}",
+    "sub": "{0} - {1}",
+    "mul": "{0} * {1}",
+    "div": "({0} / {1} if {1} != 0 else 0.0)",
+    "min": "({0} if {0} < {1} else {1})",
+    "max": "({0} if {0} > {1} else {1})",
+    "neg": "-{0}",
+    "sqrt": "(_sqrt({0}) if {0} > 0 else 0.0)",
+}
+
+AST_BINARY_OPS = {
+    ast.Add: "add",
+    ast.Sub: "sub",
+    ast.Mult: "mul",
+    ast.Div: "div",
+}
+
+
+class ExpressionError(Exception):
+    pass
+
+
+# Lowers parsed expressions into a shared graph of primitive operations.
+# Nodes are tuples: ("input", idx), ("const", value), (op, arg_node, ...)
+# Identical subexpressions collapse into the same node so they are evaluated once.
+class ExpressionGraph:
+    def __init__(self):
+        self.nodes = []
+        self.node_ids = {}
+        self.definitions = {}
+
+    def add_node(self, key):
+        if key not in self.node_ids:
+            self.node_ids[key] = len(self.nodes)
+            self.nodes.append(key)
+        return self.node_ids[key]
+
+    def lower(self, node, line_no):
+        if isinstance(node, ast.Expression):
+            return self.lower(node.body, line_no)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            try:
+                value = float(node.value)
+            except OverflowError:
+                value = math.inf
+            # inf and nan have no literal in the generated python
+            if not math.isfinite(value):
+                raise ExpressionError(f"line {line_no}: constant is too large")
+            return self.add_node(("const", value))
+        if isinstance(node, ast.Name):
+            if node.id in self.definitions:
+                return self.definitions[node.id]
+            if node.id in INPUT_INDEX:
+                return self.add_node(("input", INPUT_INDEX[node.id]))
+            raise ExpressionError(f"line {line_no}: unknown name '{node.id}'")
+        if isinstance(node, ast.UnaryOp):
+            operand = self.lower(node.operand, line_no)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            if isinstance(node.op, ast.USub):
+                return self.add_node(("neg", operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in AST_BINARY_OPS:
+            left = self.lower(node.left, line_no)
+            right = self.lower(node.right, line_no)
+            return self.add_node((AST_BINARY_OPS[type(node.op)], left, right))
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and not node.keywords
+        ):
+            args = [self.lower(arg, line_no) for arg in node.args]
+            return self.lower_call(node.func.id, args, line_no)
+        raise ExpressionError(f"line {line_no}: unsupported syntax")
+
+    # Returns only the nodes the outputs depend on, renumbered, and the
+    # renumbered outputs. Node order is kept, so arguments still come first.
+    def pruned(self, outputs):
+        needed = set()
+        pending = list(outputs)
+        while len(pending) > 0:
+            node = pending.pop()
+            if node in needed:
+                continue
+            needed.add(node)
+            key = self.nodes[node]
+            if key[0] not in ("input", "const"):
+                pending.extend(key[1:])
+
+        renumbered = {}
+        nodes = []
+        for node in sorted(needed):
+            key = self.nodes[node]
+            if key[0] not in ("input", "const"):
+                key = (key[0],) + tuple(renumbered[arg] for arg in key[1:])
+            renumbered[node] = len(nodes)
+            nodes.append(key)
+        return nodes, [renumbered[node] for node in outputs]
+
+    def lower_call(self, name, args, line_no):
+        if name in ("min", "max") and len(args) >= 2:
+            result = args[0]
+            for arg in args[1:]:
+                result = self.add_node((name, result, arg))
+            return result
+        if name == "sqrt" and len(args) == 1:
+            return self.add_node(("sqrt", args[0]))
+        if name == "clip" and len(args) == 3:
+            value, low, high = args
+            return self.add_node(("min", self.add_node(("max", value, low)), high))
+        # scale(x, factor, offset=0) -> (x - offset) * factor
+        if name == "scale" and len(args) in (2, 3):
+            value = args[0]
+            if len(args) == 3:
+                value = self.add_node(("sub", value, args[2]))
+            return self.add_node(("mul", value, args[1]))
+        raise ExpressionError(
+            f"line {line_no}: bad call to '{name}' with {len(args)} arguments"
+        )
+
+
+# A compiled set of parameter expressions.
+# Every frame is evaluated with straight-line python generated from the graph,
+# since per-call numpy overhead dominates at a single frame.
+class ExpressionProgram:
+    def __init__(self, names, nodes, outputs):
+        self.names = list(names)
+        # features from compute_params.FEATURES that the inputs are read from
+        self.features = set()
+        for key in nodes:
+            if key[0] != "input":
+                continue
+            if key[1] < LANDMARK_INPUT_OFFSET:
+                self.features.add("blendshape_scores")
+            elif key[1] < POSE_INPUT_OFFSET:
+                self.features.add(INPUT_NAMES[key[1]])
+            else:
+                self.features.add("pose")
+        self.evaluate = self.compile_frame_evaluator(nodes, outputs)
+
+    def compile_frame_evaluator(self, nodes, outputs):
+        lines = ["def evaluate(x):"]
+        for node, key in enumerate(nodes):
+            op = key[0]
+            if op == "input":
+                value = f"x[{key[1]}]"
+            elif op == "const":
+                value = repr(key[1])
+            else:
+                value = FRAME_OPS[op].format(*[f"r{arg}" for arg in key[1:]])
+            lines.append(f"    r{node} = {value}")
+        lines.append(f"    return [{', '.join(f'r{node}' for node in outputs)}]")
+        namespace = {"_sqrt": math.sqrt}
+        exec(compile("\n".join(lines), "<parameter expressions>", "exec"), namespace)
+        return namespace["evaluate"]
+
+
+# Parameters named in disabled are still defined for use in other expressions,
+# but are not sent, and anything only they depend on is not computed
+def compile_expressions(source, disabled=()):
+    graph = ExpressionGraph()
+    names = []
+    outputs = []
+    for line_no, line in enumerate(source.splitlines(), start=1):
+        line = line.split("#", 1)[0].strip()
+        if line == "":
+            continue
+        if "=" not in line:
+            raise ExpressionError(f"line {line_no}: expected 'Name = expression'")
+        name, expression = [part.strip() for part in line.split("=", 1)]
+        if not name.isidentifier():
+            raise ExpressionError(f"line {line_no}: invalid parameter name '{name}'")
+        try:
+            tree = ast.parse(expression, mode="eval")
+            node = graph.lower(tree, line_no)
+        except SyntaxError as e:
+            raise ExpressionError(f"line {line_no}: {e.msg}")
+        except (RecursionError, MemoryError):
+            raise ExpressionError(f"line {line_no}: expression is nested too deeply")
+        except ValueError as e:
+            # such as null bytes in the source
+            raise ExpressionError(f"line {line_no}: {e}")
+        graph.definitions[name] = node
+        # names starting with an underscore are helpers and are not sent
+        if not name.startswith("_") and name not in disabled:
+            if name in names:
+                raise ExpressionError(f"line {line_no}: '{name}' defined twice")
+            names.append(name)
+            outputs.append(node)
+    nodes, outputs = graph.pruned(outputs)
+    return ExpressionProgram(names, nodes, outputs)
+
+
+def load_expressions(path, disabled=()):
+    with open(path, "r", encoding="utf-8") as expression_file:
+        try:
+            source = expression_file.read()
+        except UnicodeDecodeError as e:
+            raise ExpressionError(f"not valid UTF-8: {e}")
+    return compile_expressions(source, disabled)
+
+
+# Polls the expression file and swaps in the recompiled program when it changes.
+# Readers should grab `program` once per frame; the swap is a single reference
+# assignment, so a frame always sees either the old or the new program.
+# on_reload is called with each newly loaded program.
+class ExpressionWatcher:
+    def __init__(self, path, disabled=(), on_reload=None, poll_interval=0.5):
+        self.path = path
+        self.disabled = disabled
+        self.on_reload = on_reload
+        self.poll_interval = poll_interval
+        self.mtime = os.stat(path).st_mtime_ns
+        self.program = load_expressions(path, disabled)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self.watch, name="expression watcher", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def watch(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                continue
+            if mtime == self.mtime:
+                continue
+            self.mtime = mtime
+            try:
+                start = time.perf_counter()
+                program = load_expressions(self.path, self.disabled)
+            except (OSError, ExpressionError) as e:
+                print(f"Keeping previous parameters, unable to reload {self.path}: {e}")
+                continue
+            self.program = program
+            if self.on_reload is not None:
+                self.on_reload(program)
+            compile_ms = (time.perf_counter() - start) * 1000
+            print(
+                f"Reloaded {len(program.names)} parameters from {self.path} ({compile_ms:.1f} ms)"
+            )
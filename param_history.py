@@ -0,0 +1,107 @@
+import numpy as np
+
+from param_expressions import BLENDSHAPE_NAMES
+
+
+# Fixed capacity history of named values, for a single writer thread.
+# Every row is written twice, at slot and slot + capacity, so the newest rows
+# are always contiguous and readers get views without copying. The row count is
+# only advanced after a row is fully written, so readers never need a lock.
+# Views may be overwritten by later appends; readers that hold on to a view for
+# more than a few frames should copy it or check overwritten().
+class ParameterHistory:
+    def __init__(self, names, capacity):
+        self.names = list(names)
+        self.index = {name: idx for idx, name in enumerate(self.names)}
+        self.capacity = capacity
+        self.timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self.values = np.zeros((2 * capacity, len(self.names)))
+        self.count = 0
+
+    def append(self, timestamp_ms, values):
+        slot = self.count % self.capacity
+        self.values[slot] = values
+        self.values[slot + self.capacity] = values
+        self.timestamps[slot] = timestamp_ms
+        self.timestamps[slot + self.capacity] = timestamp_ms
+        self.count += 1
+
+    # Returns (timestamps, values, count) views of the newest rows
+    def latest(self, rows):
+        count = self.count
+        rows = min(rows, count, self.capacity)
+        end = count % self.capacity + self.capacity
+        return self.timestamps[end - rows : end], self.values[end - rows : end], count
+
+    # Returns (timestamps, values, count) views of the rows from the last seconds
+    def window(self, seconds):
+        timestamps, values, count = self.latest(self.capacity)
+        if len(timestamps) == 0:
+            return timestamps, values, count
+        start = np.searchsorted(timestamps, timestamps[-1] - seconds * 1000)
+        return timestamps[start:], values[start:], count
+
+    # True if rows returned along with count have since been overwritten
+    def overwritten(self, count, rows):
+        return self.count - count > self.capacity - rows
+
+    def channel(self, values, name):
+        return values[:, self.index[name]]
+
+    # Mean absolute frame to frame change of each value, a measure of jitter
+    def jitter(self, seconds):
+        _, values, _ = self.window(seconds)
+        if len(values) < 2:
+            return np.zeros(len(self.names))
+        return np.abs(np.diff(values, axis=0)).mean(axis=0)
+
+
+# Records raw blendshape scores and computed parameters for each frame.
+# The parameter history is replaced when the parameter names change, such as
+# when the expression file is reloaded.
+class DetectionHistory:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.blendshapes = ParameterHistory(BLENDSHAPE_NAMES, capacity)
+        self.parameters = None
+
+    def record(self, timestamp_ms, detection_result, request):
+        # blendshapes are missing if the detector was created without them
+        if len(detection_result.face_blendshapes) > 0:
+            self.blendshapes.append(
+                timestamp_ms,
+                [shape.score for shape in detection_result.face_blendshapes[0]],
+            )
+        parameter_values = request["data"]["parameterValues"]
+        names = [parameter["id"] for parameter in parameter_values]
+        parameters = self.parameters
+        if parameters is None or parameters.names != names:
+            parameters = ParameterHistory(names, self.capacity)
+            self.parameters = parameters
+        parameters.append(
+            timestamp_ms, [parameter["value"] for parameter in parameter_values]
+        )
+
+    # Saves the rows from the last seconds
+    def save(self, path, seconds):
+        blendshape_timestamps, blendshape_values, _ = self.blendshapes.window(seconds)
+        data = {
+            "blendshape_names": np.array(self.blendshapes.names),
+            "blendshape_timestamps": blendshape_timestamps,
+            "blendshape_values": blendshape_values,
+        }
+        if self.parameters is not None:
+            timestamps, values, _ = self.parameters.window(seconds)
+            data["parameter_names"] = np.array(self.parameters.names)
+            data["parameter_timestamps"] = timestamps
+            data["parameter_values"] = values
+        np.savez(path, **data)
+
+    def summary(self, seconds):
+        if self.parameters is None:
+            return ""
+        jitter = self.parameters.jitter(seconds)
+        lines = [f"Parameter jitter over the last {seconds} s:"]
+        for name, value in zip(self.parameters.names, jitter):
+            lines.append(f"  {name}: {value:.4f}")
+        return "\n".join(lines)
@@ -0,0 +1,168 @@
+from collections import Counter
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+SAMPLING_SWITCH_INTERVAL_SEC = 0.0002
+
+
+def thread_cpu_time(thread_id):
+    # per thread CPU clocks are only available on unix
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError):
+        return None
+
+
+def collapse_stack(thread_name, frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        name = getattr(code, "co_qualname", code.co_name)
+        names.append(f"{name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+def write_collapsed(path, counts):
+    with open(path, "w") as collapsed_file:
+        for stack, count in counts.most_common():
+            if count > 0:
+                collapsed_file.write(f"{stack} {count}\n")
+
+
+# Samples the Python stacks of every thread for a fixed duration and writes them
+# in the collapsed stack format read by flamegraph.pl and speedscope, one file
+# weighted by wall time and one by thread CPU time, both in microseconds.
+# Nothing runs until a profile is started: the sampling thread only exists
+# while profiling. Only Python frames are seen, so time in compiled code such
+# as scipy's Rotation.from_matrix is charged to its Python caller (get_pose).
+# Threads started outside Python, such as the one mediapipe calls the result
+# callback from, are named "native thread <id>".
+class SamplingProfiler:
+    def __init__(self, interval_ms, output_dir="."):
+        self.interval_sec = interval_ms / 1000
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.thread = None
+
+    # Returns the output path prefix, or None if a profile is already running
+    def start(self, seconds):
+        # never block, this is also called from a signal handler
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            if self.thread is not None and self.thread.is_alive():
+                return None
+            path_prefix = os.path.join(
+                self.output_dir,
+                f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}",
+            )
+            self.thread = threading.Thread(
+                target=self.run,
+                args=(seconds, path_prefix),
+                name="profiler",
+                daemon=True,
+            )
+            self.thread.start()
+            return path_prefix
+        finally:
+            self.lock.release()
+
+    def run(self, seconds, path_prefix):
+        own_id = threading.get_ident()
+        wall = Counter()
+        cpu = Counter()
+        last_cpu = {}
+        samples = 0
+        # without this, the sampler mostly gets the GIL when other threads
+        # release it in native code, hiding time spent in pure Python
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(SAMPLING_SWITCH_INTERVAL_SEC)
+        start = time.monotonic()
+        last = start
+        while last - start < seconds:
+            time.sleep(self.interval_sec)
+            now = time.monotonic()
+            elapsed_us = int((now - last) * 1_000_000)
+            last = now
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = collapse_stack(
+                    thread_names.get(thread_id, f"native thread {thread_id}"), frame
+                )
+                wall[stack] += elapsed_us
+                # CPU used since the last sample is charged to the current stack
+                cpu_time = thread_cpu_time(thread_id)
+                if cpu_time is not None:
+                    if thread_id in last_cpu:
+                        cpu[stack] += int((cpu_time - last_cpu[thread_id]) * 1_000_000)
+                    last_cpu[thread_id] = cpu_time
+            samples += 1
+        sys.setswitchinterval(switch_interval)
+
+        try:
+            write_collapsed(path_prefix + ".wall.collapsed", wall)
+            if len(cpu) > 0:
+                write_collapsed(path_prefix + ".cpu.collapsed", cpu)
+        except OSError as e:
+            print(f"Unable to write profile: {e}")
+            return
+        print(f"Profile of {samples} samples written to {path_prefix}.*.collapsed")
+
+    # Starts a profile of the given length on SIGUSR1, where signals are available
+    def install_signal(self, seconds):
+        if not hasattr(signal, "SIGUSR1"):
+            return False
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.start(seconds))
+        return True
+
+    # Listens on localhost for "profile [seconds]" commands, one per connection
+    def serve(self, port, seconds):
+        server = socket.create_server(("127.0.0.1", port))
+
+        def serve_commands():
+            while True:
+                connection, _ = server.accept()
+                with connection:
+                    command = connection.recv(1024).decode(errors="replace").split()
+                    try:
+                        if len(command) == 0 or command[0] != "profile":
+                            raise ValueError("expected 'profile [seconds]'")
+                        duration = float(command[1]) if len(command) > 1 else seconds
+                    except ValueError as e:
+                        connection.sendall(f"error: {e}\n".encode())
+                        continue
+                    path_prefix = self.start(duration)
+                    if path_prefix is None:
+                        reply = "already profiling\n"
+                    else:
+                        reply = f"profiling for {duration} s, writing {path_prefix}.*.collapsed\n"
+                    connection.sendall(reply.encode())
+
+        threading.Thread(
+            target=serve_commands, name="profile control", daemon=True
+        ).start()
+
+
+# Sets up the profiler triggers for this process. Only one process can listen on
+# the control port, so child processes pass control=False and use the signal.
+def create_profiler(args, control=True):
+    profiler = SamplingProfiler(args.profile_interval_ms)
+    profiler.install_signal(args.profile_seconds)
+    if control and args.profile_port > 0:
+        try:
+            profiler.serve(args.profile_port, args.profile_seconds)
+        except OSError as e:
+            print(
+                f"Unable to listen for profile commands on port {args.profile_port}: {e}"
+            )
+    return profiler
@@ -0,0 +1,91 @@
+from multiprocessing import resource_tracker, shared_memory
+import secrets
+
+import numpy as np
+
+WRITING = -1
+
+
+# Fixed size ring of arrays in shared memory, one writer and any number of readers.
+# The shared block holds [latest sequence, per slot sequence] as int64, then the
+# per slot timestamps as int64, then the slots themselves.
+# A slot's sequence is set to WRITING while it is being written, so a reader can
+# check a view is still the frame it asked for after using it.
+class SharedRing:
+    def __init__(self, shape, dtype, slots, name=None, create=False, unregister=False):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.create = create
+
+        header_bytes = (1 + slots) * 8
+        timestamp_bytes = slots * 8
+        slot_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        size = header_bytes + timestamp_bytes + slots * slot_bytes
+        if create:
+            if name is None:
+                name = f"lilac_{secrets.token_hex(4)}"
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Processes started by the creator share its resource tracker.
+            # Unrelated processes must unregister the block, or their tracker
+            # unlinks it when they exit.
+            if unregister:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = self.shm.name
+
+        self.header = np.ndarray((1 + slots,), dtype=np.int64, buffer=self.shm.buf)
+        self.timestamps = np.ndarray(
+            (slots,), dtype=np.int64, buffer=self.shm.buf, offset=header_bytes
+        )
+        self.data = np.ndarray(
+            (slots,) + self.shape,
+            dtype=self.dtype,
+            buffer=self.shm.buf,
+            offset=header_bytes + timestamp_bytes,
+        )
+        if create:
+            self.header[:] = WRITING
+
+    # Arguments needed to attach to this ring from another process
+    def attach_args(self):
+        return (self.shape, self.dtype.str, self.slots, self.name)
+
+    @classmethod
+    def attach(cls, shape, dtype, slots, name, unregister=False):
+        return cls(shape, dtype, slots, name=name, unregister=unregister)
+
+    def write(self, array, timestamp):
+        sequence = int(self.header[0]) + 1
+        slot = sequence % self.slots
+        self.header[1 + slot] = WRITING
+        self.data[slot] = array
+        self.timestamps[slot] = timestamp
+        self.header[1 + slot] = sequence
+        self.header[0] = sequence
+        return sequence
+
+    def latest_sequence(self):
+        return int(self.header[0])
+
+    # Returns (timestamp, view) of a written slot without copying, or None if
+    # it has already been overwritten
+    def read(self, sequence):
+        if sequence < 0:
+            return None
+        slot = sequence % self.slots
+        timestamp = int(self.timestamps[slot])
+        if self.header[1 + slot] != sequence:
+            return None
+        return timestamp, self.data[slot]
+
+    def is_valid(self, sequence):
+        return self.header[1 + sequence % self.slots] == sequence
+
+    def close(self):
+        # views must be released before the buffer can be closed
+        del self.header, self.timestamps, self.data
+        self.shm.close()
+        if self.create:
+            self.shm.unlink()
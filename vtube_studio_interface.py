@@ -1,10 +1,11 @@
 import json
-import sys
+import time
 
 from compute_params import (
-    compute_params_from_blendshapes,
-    compute_params_from_matrix,
-    compute_params_from_landmarks,
+    PARAMETERS,
+    FrameFeatures,
+    compute_params_from_features,
+    compute_params_from_program,
 )
 
 
@@ -15,7 +16,7 @@ def validate_connect_response(message_json):
         print("Authentication Successful!")
     else:
         print("Authentication failed!")
-        sys.exit(1)
+        raise ConnectionError("authentication refused")
 
 
 def get_authentication_token(websocket, auth_file=""):
@@ -41,7 +42,7 @@ def get_authentication_token(websocket, auth_file=""):
         return response["data"]["authenticationToken"]
 
 
-def vtube_studio_authenticate(websocket, auth_token):
+def vtube_studio_authenticate(websocket, auth_token, timeout=None):
     out_message = {
         "apiName": "VTubeStudioPublicAPI",
         "apiVersion": "1.0",
@@ -56,12 +57,12 @@ def vtube_studio_authenticate(websocket, auth_token):
     out_message_json = json.dumps(out_message)
 
     websocket.send(out_message_json)
-    message = websocket.recv()
+    message = websocket.recv(timeout=timeout)
     validate_connect_response(message)
 
 
-def send_detection_results(detection_result, websocket):
-    request = {
+def create_parameter_request():
+    return {
         "apiName": "VTubeStudioPublicAPI",
         "apiVersion": "1.0",
         "requestID": "lilacsMediaPipeForward",
@@ -69,25 +70,45 @@ def send_detection_results(detection_result, websocket):
         "data": {"faceFound": False, "mode": "add", "parameterValues": []},
     }
 
-    face_blendshapes_list = detection_result.face_blendshapes
-    if len(face_blendshapes_list) == 0:
-        # Do nothing if no shapes found
-        return True
-    face_blendshapes = face_blendshapes_list[0]  # only care about a single face
-    face_landmarks = detection_result.face_landmarks[0]
-    compute_params_from_landmarks(request, face_landmarks)
-    compute_params_from_blendshapes(request, face_blendshapes)
 
-    compute_params_from_matrix(
-        request, detection_result.facial_transformation_matrixes[0]
-    )
+# Returns the parameter request for a detection, or None if no face was found.
+# Uses the expression program if given, otherwise the listed parameters from
+# compute_params.PARAMETERS (all of them by default).
+def compute_detection_params(
+    detection_result,
+    program=None,
+    parameters=None,
+    compute_budget=None,
+    region_cache=None,
+):
+    if len(detection_result.face_landmarks) == 0:
+        return None
+
+    start = time.perf_counter()
+    request = create_parameter_request()
+    # only care about a single face
+    frame = FrameFeatures(detection_result, compute_budget, region_cache)
+    if program is not None:
+        compute_params_from_program(request, program, frame)
+    else:
+        if parameters is None:
+            parameters = PARAMETERS
+        compute_params_from_features(request, frame, parameters)
+    if compute_budget is not None:
+        compute_budget.end_frame(time.perf_counter() - start)
+    return request
 
+
+def send_parameter_request(request, websocket, timeout=None):
     # only write if there are parameters to set
     if len(request["data"]["parameterValues"]) > 0:
         request_json = json.dumps(request)
         try:
             websocket.send(request_json)
-            websocket.recv(decode=False)
+            websocket.recv(timeout=timeout, decode=False)
+        except TimeoutError:
+            print("No reply to blendshape data")
+            return False
         except:
             print("Issue sending/receiving blendshape data")
             return False